@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""
+ (c) 2017 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+
+Activity on the tickets, as recorded in the history of their git
+repository.
+
+The history is walked only once, the commits seen are cached in the git
+folder of the repository (sorted by date, most recent first) and the
+following calls only walk the commits made since.
+
+"""
+
+import heapq
+import logging
+import os
+
+import pag_off.codec
+import pag_off.utils
+
+
+_log = logging.getLogger(__name__)
+
+CACHE_FILE = 'pag-off-activity.json'
+
+# Separators used in the output of git log
+_RECORD = '\x1e'
+_FIELD = '\x1f'
+
+
+def _cache_path(folder):
+    """ Return the path of the cache file of the git repository in the
+    specified folder. """
+    git_dir = pag_off.utils._run_shell_cmd(
+        ['git', 'rev-parse', '--git-dir'],
+        directory=folder, return_stdout=True).decode('utf-8')
+    return os.path.join(folder, git_dir, CACHE_FILE)
+
+
+def _by_date(commit):
+    """ Sort key of the commits: their date. """
+    return commit['date']
+
+
+def _git_log(folder, revisions):
+    """ Return the commits in the given revisions of the git repository in
+    the specified folder, along with the files they touched, most recent
+    first.
+    """
+    output = pag_off.utils._run_shell_cmd(
+        ['git', 'log', '--name-only', '--no-renames',
+         '--format=%s%%H%s%%an%s%%at%s%%s' % (
+             _RECORD, _FIELD, _FIELD, _FIELD)] + revisions + ['--'],
+        directory=folder, return_stdout=True).decode('utf-8')
+
+    commits = []
+    for record in output.split(_RECORD):
+        if not record.strip():
+            continue
+        header, _, files = record.partition('\n')
+        sha, author, date, subject = header.split(_FIELD, 3)
+        commits.append({
+            'sha': sha,
+            'author': author,
+            'date': int(date),
+            'subject': subject,
+            'files': [
+                filename for filename in files.splitlines()
+                if filename and '/' not in filename and '.' not in filename
+            ],
+        })
+    # git log lists the commits in the order of the history, which may not
+    # be the order of their dates
+    commits.sort(key=_by_date, reverse=True)
+    return commits
+
+
+def _is_commit(folder, revision):
+    """ Return whether the given revision is a commit of the git repository
+    in the specified folder. """
+    try:
+        pag_off.utils._run_shell_cmd(
+            ['git', 'cat-file', '-e', '%s^{commit}' % revision],
+            directory=folder)
+    except Exception:
+        return False
+    return True
+
+
+def update_cache(folder):
+    """ Bring the cache of the activity of the git repository in the
+    specified folder up to date and return it.
+
+    Only the commits made since the last call are walked. If the history
+    was rewritten since (ie: by a rebase), the commits which are no longer
+    part of it are dropped from the cache.
+
+    :arg folder: The folder containing the git repository
+    :type folder: str
+    :return: The commits of the repository, most recent first, each commit
+        being a dict with the keys: sha, author, date, subject and files
+    :rtype: list
+
+    """
+    cache_path = _cache_path(folder)
+    cache = {'head': None, 'commits': []}
+    if os.path.exists(cache_path):
+        try:
+            cache = pag_off.codec.load_file(cache_path)
+        except pag_off.codec.DecodeError:
+            _log.info('Invalid cache: %s, starting over', cache_path)
+        if not isinstance(cache.get('commits'), list):
+            # Cache written by a previous version
+            cache = {'head': None, 'commits': []}
+
+    try:
+        head = pag_off.utils._run_shell_cmd(
+            ['git', 'rev-parse', '--verify', '--quiet', 'HEAD'],
+            directory=folder, return_stdout=True).decode('utf-8')
+    except Exception:
+        # Empty repository
+        return []
+
+    last = cache['head']
+    if last == head:
+        return cache['commits']
+
+    if last and _is_commit(folder, last):
+        _log.debug('Walking the history from %s to %s', last, head)
+        commits = cache['commits']
+        # Commits which are no longer in the history
+        removed = set(
+            commit['sha']
+            for commit in _git_log(folder, [last, '--not', head]))
+        if removed:
+            commits = [
+                commit for commit in commits if commit['sha'] not in removed]
+        # Both lists are sorted, merging them keeps the cache sorted
+        cache['commits'] = list(heapq.merge(
+            _git_log(folder, ['%s..%s' % (last, head)]), commits,
+            key=_by_date, reverse=True))
+    else:
+        _log.debug('Walking the entire history up to %s', head)
+        cache['commits'] = _git_log(folder, [head])
+
+    cache['head'] = head
+    with open(cache_path, 'wb') as stream:
+        stream.write(pag_off.codec.dumps_compact(cache))
+    return cache['commits']
+
+
+def get_activity(repo, since=None):
+    """ Return the changes made to the tickets of the given repository.
+
+    :arg repo: The repository of the tickets
+    :type repo: pag_off.repository.TicketRepository
+    :kwarg since: If specified, only return the changes made at or after
+        this unix timestamp
+    :type since: int
+    :return: A list of dict with the keys: sha, author, date, subject,
+        filename and ticket (None if the ticket no longer exists), most
+        recent first
+    :rtype: list
+
+    """
+    activity = []
+    for commit in update_cache(repo.folder):
+        if since is not None and commit['date'] < since:
+            # The commits are sorted, the following ones are older
+            break
+        for filename in commit['files']:
+            activity.append({
+                'sha': commit['sha'],
+                'author': commit['author'],
+                'date': commit['date'],
+                'subject': commit['subject'],
+                'filename': filename,
+                'ticket': repo.get_file(filename),
+            })
+    return activity
@@ -9,15 +9,23 @@
 """
 
 import argparse
+import concurrent.futures
 import configparser
+import datetime
 import logging
 import os
 import sys
+import time
 
 from tabulate import tabulate
 
+import pag_off.activity
 import pag_off.exceptions
+import pag_off.importer
+import pag_off.repository
+import pag_off.stats
 import pag_off.utils
+import pag_off.watch
 
 
 _log = logging.getLogger(__name__)
@@ -35,26 +43,61 @@ MIN_CONFIG = {
 
 
 def do_clone(args, config):
-    """ Clone the desired git repository. """
-    base_url = config.get('main', 'base_url')
-    if base_url:
-        base_url.rstrip('/')
-    print(base_url)
-    url = '{0}/{1}/{2}'.format(base_url, args.repo, args.project)
-    print(url)
-    print('This has not yet been implemented')
+    """ Clone the desired git repositories. """
+    _log.debug('projects:       %s', args.project)
+    _log.debug('repo:           %s', args.repo)
+    _log.debug('filter:         %s', args.filter)
+    _log.debug('depth:          %s', args.depth)
+    _log.debug('sparse:         %s', args.sparse)
+    _log.debug('jobs:           %s', args.jobs)
+
+    base_url = config.get('main', 'base_url').rstrip('/')
+
+    def _clone(project):
+        """ Clone the specified project, returns whether it was cloned or
+        if it was already present. """
+        project_folder = pag_off.repository.TicketRepository.for_project(
+            config, project).folder
+        if os.path.exists(project_folder):
+            return False
+        url = '{0}/{1}/{2}.git'.format(base_url, args.repo, project)
+        _log.debug('Cloning %s in: %s', url, project_folder)
+        pag_off.utils.clone_repo(
+            url, project_folder, filter_spec=args.filter,
+            depth=args.depth, sparse=args.sparse)
+        pag_off.utils.register_merge_driver(project_folder)
+        return True
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, args.jobs)) as executor:
+        futures = {
+            executor.submit(_clone, project): project
+            for project in args.project
+        }
+        for future in concurrent.futures.as_completed(futures):
+            project = futures[future]
+            try:
+                if future.result():
+                    print('%s cloned' % project)
+                else:
+                    print('%s already present, use `update` instead' % project)
+            except Exception as err:
+                _log.debug('Failed to clone %s: %s', project, err)
+                print('Failed to clone %s: %s' % (project, err))
+                failed.append(project)
+
+    if failed:
+        raise pag_off.exceptions.CloneFailed(
+            'Could not clone: %s' % ', '.join(sorted(failed)))
 
 
 def do_update(args, config):
     """ Runs git pull--rebased on the desired git repository. """
     _log.debug('project:        %s', args.project)
-    location = os.path.expanduser(config.get('main', 'location'))
-    project_folder = os.path.join(location, args.project)
-    _log.debug('Running git pull --rebase on:        %s', project_folder)
-    pag_off.utils._run_shell_cmd(
-        ['git', 'pull', '--rebase'],
-        directory=project_folder
-    )
+    repo = pag_off.repository.TicketRepository.for_project(
+        config, args.project)
+    repo.update()
     print('%s updated' % args.project)
 
 
@@ -64,76 +107,139 @@ def do_list(args, config):
     _log.debug('status:         %s', args.status)
     _log.debug('tags:           %s', args.tag)
     _log.debug('sort:           %s', args.sort)
+    _log.debug('limit:          %s', args.limit)
     _log.debug('mine:           %s', args.mine)
     _log.debug('assignee:       %s', args.assignee)
     _log.debug('author:         %s', args.author)
     _log.debug('milestone:      %s', args.milestone)
+    _log.debug('watch:          %s', args.watch)
 
     if args.status.lower() not in ['open', 'closed', 'all']:
         pag_off.exceptions.InvalidStatus(
             'Status: %s in not in the list of supported statuses' %
             args.status)
 
+    sort = args.sort.lower()
+    if sort not in pag_off.utils.SORT_ORDERS:
+        raise pag_off.exceptions.InvalidSort(
+            'Sort: %s is not in the list of supported sort orders: %s' % (
+                args.sort, ', '.join(sorted(pag_off.utils.SORT_ORDERS))))
+
     tags = args.tag.split(',') if args.tag else []
     # clean empty tags
     tags = [t.strip() for t in tags if t.strip()]
-    location = os.path.expanduser(config.get('main', 'location'))
-    ticket_fold = os.path.join(location, args.project)
-    _log.debug('folder:         %s', ticket_fold)
+    repo = pag_off.repository.TicketRepository.for_project(
+        config, args.project)
     assignee = None
     if args.mine:
         assignee = config.get('user', 'name')
     elif args.assignee:
         assignee = args.assignee
-    tickets = pag_off.utils.load_tickets(
-        ticket_fold, status=args.status, tags=tags,
-        assignee=assignee, author=args.author,
-        milestone=args.milestone,
-    )
+    filters = {
+        'status': args.status,
+        'tags': tags,
+        'assignee': assignee,
+        'author': args.author,
+        'milestone': args.milestone,
+    }
+    if not args.watch:
+        print('\n'.join(_tickets_table(repo.sorted_tickets(
+            sort=sort, limit=args.limit, **filters))))
+        return
+
+    matching = pag_off.repository.MatchingTickets(repo, sort=sort, **filters)
+    display = pag_off.watch.LiveDisplay()
+    display.update(_watch_table(matching, display, args.limit))
+    watcher = pag_off.watch.get_watcher(repo.folder)
+    try:
+        while True:
+            # Wake up at regular interval to update the relative dates
+            names = watcher.wait(timeout=pag_off.watch.REFRESH_INTERVAL)
+            if names is pag_off.watch.OVERFLOW:
+                _log.info('Changes were lost, reloading all the tickets')
+                repo.refresh(set(os.listdir(repo.folder)) | set(
+                    os.path.basename(filepath)
+                    for filepath in repo.filepaths()))
+                matching.rebuild()
+            else:
+                matching.update(repo.refresh(names))
+            display.update(_watch_table(matching, display, args.limit))
+    finally:
+        watcher.close()
+
+
+def _watch_table(matching, display, limit):
+    """ Return the lines of the table listing the tickets matching, only
+    the tickets which fit on the display are put in the table.
+
+    :arg matching: The tickets matching the filters of the user
+    :type matching: pag_off.repository.MatchingTickets
+    :arg display: The display on which the table is shown
+    :type display: pag_off.watch.LiveDisplay
+    :arg limit: The maximum number of tickets to list
+    :type limit: int
+    :return: The lines of the table
+    :rtype: list
+
+    """
+    total = len(matching)
+    if limit is not None:
+        total = max(0, min(limit, total))
+    # Leave room for the headers of the table and the number of tickets
+    shown = max(1, display.height() - 3)
+    return _tickets_table(matching.top(min(total, shown)), total=total)
+
+
+def _tickets_table(tickets, total=None):
+    """ Return the lines of the table listing the given tickets.
+
+    :arg tickets: The tickets to list, in the order to show them
+    :type tickets: list
+    :kwarg total: The number of tickets found, if more than the ones listed
+    :type total: int
+    :return: The lines of the table
+    :rtype: list
+
+    """
+    if total is None:
+        total = len(tickets)
     table = []
-    headers = None
-    cnt = 0
+    headers = ()
     if tickets:
         headers = [
             '#id', 'title', 'Opened', 'Modified', 'Reporter', 'Assignee']
-        reverse = True if args.sort.lower() == 'newer' else False
-        for key in sorted(tickets, reverse=reverse):
-            data = tickets[key]
+        for data in tickets:
             assignee = data.get('assignee')
             table.append([
-                key,
+                data['id'],
                 data['title'],
                 pag_off.utils.humanize(data['date_created']),
                 pag_off.utils.humanize(data['last_updated']),
                 data['user']['name'],
                 assignee['name'] if assignee else ''
             ])
-            cnt += 1
     else:
         table.append(['No tickets found with these criterias'])
-    print(tabulate(table, headers=headers))
-    if cnt:
-        print('%s tickets found' % cnt)
+    lines = tabulate(table, headers=headers).splitlines()
+    if total:
+        lines.append('%s tickets found' % total)
+    return lines
 
 
 def do_list_milestones(args, config):
     """ List all the milestones in the specified git repository. """
     _log.debug('project:        %s', args.project)
 
-    location = os.path.expanduser(config.get('main', 'location'))
-    ticket_fold = os.path.join(location, args.project)
-    _log.debug('folder:         %s', ticket_fold)
-    assignee = None
-    tickets = pag_off.utils.load_tickets(ticket_fold, status='all')
+    repo = pag_off.repository.TicketRepository.for_project(
+        config, args.project)
     milestones = set(
-        tickets[ticket]['milestone']
-        for ticket in tickets
-        if tickets[ticket]['milestone']
-            and str(tickets[ticket]['milestone']) != 'None'
+        milestone
+        for milestone in repo.field_values('milestone')
+        if str(milestone) != 'None'
     )
 
     table = []
-    headers = None
+    headers = ()
     cnt = 0
     if milestones:
         headers = ['Milestones']
@@ -149,18 +255,110 @@ def do_list_milestones(args, config):
         print('%s milestones found' % cnt)
 
 
+def do_stats(args, config):
+    """ Show statistics about the tickets in the specified git repository.
+    """
+    _log.debug('project:        %s', args.project)
+
+    repo = pag_off.repository.TicketRepository.for_project(
+        config, args.project)
+    tickets = repo.filter(status='all')
+    if not tickets:
+        print('No tickets found in this project')
+        return
+
+    columns = pag_off.stats.build_columns(tickets)
+    stats = pag_off.stats.compute_stats(columns, percentiles=(50, 90))
+    duration2str = pag_off.stats.duration2str
+
+    print(tabulate([
+        ['Tickets', stats['total']],
+        ['Open', stats['open']],
+        ['Open and unassigned', stats['unassigned']],
+        ['Median time to close', duration2str(stats['median_to_close'])],
+        ['Median age of the backlog',
+         duration2str(stats['age_percentiles'][0])],
+        ['90th percentile age of the backlog',
+         duration2str(stats['age_percentiles'][1])],
+    ], disable_numparse=True))
+
+    for title, names, counts in [
+            ('Tag', columns['tags'], stats['open_per_tag']),
+            ('Assignee', columns['assignees'], stats['open_per_assignee']),
+            ('Milestone', columns['milestones'],
+             stats['open_per_milestone']),
+    ]:
+        table = sorted(
+            ([name, count] for name, count in zip(names, counts) if count),
+            key=lambda row: (-row[1], row[0]))
+        if table:
+            print()
+            print(tabulate(
+                table, headers=[title, 'Open'], disable_numparse=True))
+
+    print()
+    print(tabulate(
+        [
+            [label, count]
+            for (label, _), count in zip(
+                pag_off.stats.AGE_BUCKETS, stats['age_histogram'])
+        ],
+        headers=['Age', 'Open'], disable_numparse=True))
+
+
+def do_activity(args, config):
+    """ Show the changes made to the tickets in the specified git
+    repository.
+    """
+    _log.debug('project:        %s', args.project)
+    _log.debug('since:          %s', args.since)
+
+    repo = pag_off.repository.TicketRepository.for_project(
+        config, args.project)
+    if args.since:
+        since = pag_off.utils.to_timestamp(args.since)
+    else:
+        since = int(time.time()) - 7 * 24 * 60 * 60
+    activity = pag_off.activity.get_activity(repo, since=since)
+
+    table = []
+    headers = ()
+    if activity:
+        headers = ['Date', 'Author', '#id', 'title', 'Change']
+        for change in activity:
+            ticket = change['ticket']
+            table.append([
+                pag_off.utils.humanize(change['date']),
+                change['author'],
+                ticket['id'] if ticket else '',
+                ticket['title'] if ticket else change['filename'],
+                change['subject'],
+            ])
+    else:
+        table.append(['No activity found in this period'])
+    print(tabulate(table, headers=headers, disable_numparse=True))
+    if activity:
+        print('%s changes found' % len(activity))
+
+
 def do_view(args, config):
     """ Displays the content the tickets in the specified git repository.
     """
     _log.debug('project:        %s', args.project)
     _log.debug('ticket:         %s', args.ticket_id)
+    _log.debug('last:           %s', args.last)
+    _log.debug('since:          %s', args.since)
+    _log.debug('no comments:    %s', args.no_comments)
 
-    location = os.path.expanduser(config.get('main', 'location'))
-    ticket_fold = os.path.join(location, args.project)
-    _log.debug('folder:         %s', ticket_fold)
-    ticket = pag_off.utils.load_tickets(
-        ticket_fold, ticket_id=args.ticket_id)[0]
-    print(pag_off.utils.ticket2str(ticket))
+    repo = pag_off.repository.TicketRepository.for_project(
+        config, args.project)
+    ticket = repo.get(args.ticket_id)[0]
+    since = None
+    if args.since:
+        since = pag_off.utils.to_timestamp(args.since)
+    pag_off.utils.page(pag_off.utils.ticket2chunks(
+        ticket, last=args.last, since=since,
+        comments=not args.no_comments))
 
 
 def do_comment(args, config):
@@ -169,13 +367,11 @@ def do_comment(args, config):
     _log.debug('project:        %s', args.project)
     _log.debug('ticket:         %s', args.ticket_id)
 
-    location = os.path.expanduser(config.get('main', 'location'))
-    ticket_fold = os.path.join(location, args.project)
-    _log.debug('folder:         %s', ticket_fold)
-    ticket, filepath = pag_off.utils.load_tickets(
-        ticket_fold, ticket_id=args.ticket_id)
+    repo = pag_off.repository.TicketRepository.for_project(
+        config, args.project)
+    ticket, filepath = repo.get(args.ticket_id)
     comment = input('Comment: ')
-    print(pag_off.utils.add_comment(ticket, filepath, comment, config))
+    print(pag_off.utils.add_comment(repo, ticket, filepath, comment, config))
 
 
 def do_take(args, config):
@@ -184,12 +380,10 @@ def do_take(args, config):
     _log.debug('project:        %s', args.project)
     _log.debug('ticket:         %s', args.ticket_id)
 
-    location = os.path.expanduser(config.get('main', 'location'))
-    ticket_fold = os.path.join(location, args.project)
-    _log.debug('folder:         %s', ticket_fold)
-    ticket, filepath = pag_off.utils.load_tickets(
-        ticket_fold, ticket_id=args.ticket_id)
-    print(pag_off.utils.take_ticke(ticket, filepath, config))
+    repo = pag_off.repository.TicketRepository.for_project(
+        config, args.project)
+    ticket, filepath = repo.get(args.ticket_id)
+    print(pag_off.utils.take_ticke(repo, ticket, filepath, config))
 
 
 def do_close(args, config):
@@ -198,24 +392,54 @@ def do_close(args, config):
     _log.debug('project:        %s', args.project)
     _log.debug('ticket:         %s', args.ticket_id)
 
-    location = os.path.expanduser(config.get('main', 'location'))
-    ticket_fold = os.path.join(location, args.project)
-    _log.debug('folder:         %s', ticket_fold)
+    repo = pag_off.repository.TicketRepository.for_project(
+        config, args.project)
 
     # Get the closed_as options
-    close_statuses = pag_off.utils.get_field_tickets(
-        ticket_fold, 'close_status')
+    close_statuses = repo.field_values('close_status')
     print('Close status available: %s' % ', '.join(close_statuses or []))
 
-    ticket, filepath = pag_off.utils.load_tickets(
-        ticket_fold, ticket_id=args.ticket_id)
+    ticket, filepath = repo.get(args.ticket_id)
     close_status = input('Close status: ')
     if close_status and close_statuses and \
             close_status not in close_statuses:
         print('This status is not in the list')
     else:
         print(pag_off.utils.close_ticket(
-            ticket, filepath, config, close_status))
+            repo, ticket, filepath, config, close_status))
+
+
+def do_import(args, config):
+    """ Import issues from other trackers as tickets in the specified git
+    repository.
+    """
+    _log.debug('project:        %s', args.project)
+    _log.debug('file:           %s', args.filename)
+    _log.debug('format:         %s', args.format)
+
+    repo = pag_off.repository.TicketRepository.for_project(
+        config, args.project)
+    user = {
+        'name': config.get('user', 'name'),
+        'default_email': config.get('user', 'default_email'),
+    }
+    start = repo.max_id() + 1
+    _log.debug('first id:       %s', start)
+    now = datetime.datetime.utcnow().strftime('%s')
+    tickets = (
+        pag_off.importer.row2ticket(row, ticket_id, user, now=now)
+        for ticket_id, row in enumerate(
+            pag_off.importer.read_rows(args.filename, fmt=args.format),
+            start=start)
+    )
+    cnt = repo.import_tickets(
+        tickets, user['name'], user['default_email'],
+        'Import issues from %s' % os.path.basename(args.filename))
+    if cnt:
+        print('%s tickets imported (#%s to #%s)' % (
+            cnt, start, start + cnt - 1))
+    else:
+        print('No tickets found to import')
 
 
 def parse_arguments():
@@ -235,13 +459,27 @@ def parse_arguments():
         'clone',
         help='Clone a specified repository')
     parser_clone.add_argument(
-        'project',
-        help="Name of the project on pagure, can be: <project>, "
+        'project', nargs='+',
+        help="Name of one or more projects on pagure, can be: <project>, "
              "<namespace>/project, fork/<user>/<project> or "
              "fork/<user>/<namespace>/<project>")
     parser_clone.add_argument(
         'repo',
         help="The type of repository to clone: tickets or pull-requests")
+    parser_clone.add_argument(
+        '--filter',
+        help="Partial clone filter given to git, for example: blob:none "
+             "to download the content of the files only when needed")
+    parser_clone.add_argument(
+        '--depth', type=int,
+        help="Only retrieve the specified number of commits of history")
+    parser_clone.add_argument(
+        '--sparse', default=False, action='store_true',
+        help="Only check out the tickets, not the attachments stored in "
+             "sub-folders")
+    parser_clone.add_argument(
+        '--jobs', type=int, default=4,
+        help="Number of projects to clone at the same time. Defaults to: 4")
     parser_clone.set_defaults(func=do_clone)
 
     # UPDATE
@@ -271,7 +509,14 @@ def parse_arguments():
     parser_list.add_argument(
         '--sort', default='newer',
         help="Specifies in which order the tickets should be shown, can be: "
-             "newer or older (cas insensitive). Defaults to: newer")
+             "newer, older, updated (most recently updated first), created "
+             "(most recently created first), priority (highest priority "
+             "first) or comments (most commented first) (cas insensitive). "
+             "Defaults to: newer")
+    parser_list.add_argument(
+        '--limit', type=int,
+        help="Only show this number of tickets, the first ones in the "
+             "order specified by --sort")
     parser_list.add_argument(
         '--tag',
         help="One or more (comma separated) tags to filter the issues with")
@@ -287,6 +532,9 @@ def parse_arguments():
     parser_list.add_argument(
         '--milestone',
         help="Return only the ticket opened for the specified milestone")
+    parser_list.add_argument(
+        '--watch', default=False, action='store_true',
+        help="Keep the list on screen and update it as the tickets change")
     parser_list.set_defaults(func=do_list)
 
     # VIEW
@@ -301,6 +549,15 @@ def parse_arguments():
     parser_view.add_argument(
         'ticket_id',
         help="Identifier of the ticket in this project")
+    parser_view.add_argument(
+        '--last', type=int,
+        help="Only show the specified number of most recent comments")
+    parser_view.add_argument(
+        '--since',
+        help="Only show the comments made since this date (ie: 2017-03-01)")
+    parser_view.add_argument(
+        '--no-comments', default=False, action='store_true',
+        help="Do not show the comments of the ticket")
     parser_view.set_defaults(func=do_view)
 
     # COMMENT
@@ -356,6 +613,50 @@ def parse_arguments():
              "fork/<user>/<namespace>/<project>")
     parser_take.set_defaults(func=do_list_milestones)
 
+    # STATS
+    parser_stats = subparsers.add_parser(
+        'stats',
+        help='Show statistics about the tickets of the project')
+    parser_stats.add_argument(
+        'project',
+        help="Name of the project on pagure, can be: <project>, "
+             "<namespace>/project, fork/<user>/<project> or "
+             "fork/<user>/<namespace>/<project>")
+    parser_stats.set_defaults(func=do_stats)
+
+    # ACTIVITY
+    parser_activity = subparsers.add_parser(
+        'activity',
+        help='Show the changes made to the tickets of the project')
+    parser_activity.add_argument(
+        'project',
+        help="Name of the project on pagure, can be: <project>, "
+             "<namespace>/project, fork/<user>/<project> or "
+             "fork/<user>/<namespace>/<project>")
+    parser_activity.add_argument(
+        '--since',
+        help="Only show the changes made since this date (ie: 2017-03-01). "
+             "Defaults to: the last 7 days")
+    parser_activity.set_defaults(func=do_activity)
+
+    # IMPORT
+    parser_import = subparsers.add_parser(
+        'import',
+        help='Import issues from another tracker as tickets')
+    parser_import.add_argument(
+        'project',
+        help="Name of the project on pagure, can be: <project>, "
+             "<namespace>/project, fork/<user>/<project> or "
+             "fork/<user>/<namespace>/<project>")
+    parser_import.add_argument(
+        'filename',
+        help="The CSV or JSONL file containing the issues to import")
+    parser_import.add_argument(
+        '--format',
+        help="The format of the file: csv or jsonl. Defaults to the "
+             "extension of the file")
+    parser_import.set_defaults(func=do_import)
+
     return parser.parse_args()
 
 
@@ -397,7 +698,7 @@ def main():
     logging.basicConfig()
     if args.debug:
         _log.setLevel(logging.DEBUG)
-        l = logging.getLogger('pag_off.utils')
+        l = logging.getLogger('pag_off')
         l.setLevel(logging.DEBUG)
 
     # Act based on the arguments given
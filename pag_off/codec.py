@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+ (c) 2017 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+
+Reading and writing of the JSON blobs of the tickets.
+
+Decoding uses orjson or ujson when one of them is installed and falls back
+to the json module of the standard library otherwise. Encoding the tickets
+always produces the same output as pagure (4 spaces indentation, sorted
+keys and ASCII-only), so the git diffs stay clean.
+
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+if orjson is not None:
+    BACKEND = 'orjson'
+    _loads = orjson.loads
+    _dumps_compact = orjson.dumps
+elif ujson is not None:
+    BACKEND = 'ujson'
+    _loads = ujson.loads
+    _dumps_compact = lambda data: ujson.dumps(data).encode('utf-8')
+else:
+    BACKEND = 'json'
+    _loads = json.loads
+    _dumps_compact = lambda data: json.dumps(
+        data, separators=(',', ':')).encode('utf-8')
+
+# The errors raised by all the backends on invalid content are sub-classes
+# of ValueError
+DecodeError = ValueError
+
+# Neither orjson (2 spaces indentation only, no ASCII escaping) nor ujson
+# (different escaping and float formatting) can reproduce pagure's format
+# byte for byte, so the encoding relies on the json module.
+_encoder = json.JSONEncoder(
+    sort_keys=True, indent=4, separators=(',', ': '))
+
+
+def loads(content):
+    """ Decode the given JSON content.
+
+    :arg content: The JSON content to decode
+    :type content: bytes or str
+    :return: The decoded data
+    :raises DecodeError: if the content is not valid JSON
+
+    """
+    return _loads(content)
+
+
+def dumps(data):
+    """ Encode the given data in the format used by pagure for the tickets.
+
+    :arg data: The data to encode
+    :type data: dict
+    :return: The JSON encoded data
+    :rtype: bytes
+
+    """
+    return _encoder.encode(data).encode('utf-8')
+
+
+def dumps_compact(data):
+    """ Encode the given data as compact JSON, using the fastest backend
+    available. This is meant for the caches of pag-off, not the tickets,
+    the output differs from one backend to another.
+
+    :arg data: The data to encode
+    :type data: dict
+    :return: The JSON encoded data
+    :rtype: bytes
+
+    """
+    return _dumps_compact(data)
+
+
+def load_file(filepath):
+    """ Load the JSON blob stored in the specified file.
+
+    :arg filepath: The path to the file to load
+    :type filepath: str
+    :return: The decoded data
+    :raises DecodeError: if the file does not contain valid JSON
+
+    """
+    with open(filepath, 'rb') as stream:
+        return loads(stream.read())
+
+
+def dump_file(data, filepath):
+    """ Write the given data in the specified file, in the format used by
+    pagure for the tickets.
+
+    :arg data: The data to write
+    :type data: dict
+    :arg filepath: The path to the file to write
+    :type filepath: str
+
+    """
+    with open(filepath, 'wb') as stream:
+        stream.write(dumps(data))
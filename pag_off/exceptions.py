@@ -19,3 +19,30 @@ class InvalidStatus(PagOffException, ValueError):
     expected statuses.
     """
     pass
+
+
+class InvalidSort(PagOffException, ValueError):
+    """ Raised when the sort order specified by the user is not in the list
+    of supported sort orders.
+    """
+    pass
+
+
+class TicketNotFound(PagOffException):
+    """ Raised when the ticket specified by the user could not be found in
+    the project.
+    """
+    pass
+
+
+class CloneFailed(PagOffException):
+    """ Raised when one or more of the repositories requested could not be
+    cloned.
+    """
+    pass
+
+
+class InvalidImport(PagOffException, ValueError):
+    """ Raised when the issues to import are not in a supported format.
+    """
+    pass
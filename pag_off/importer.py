@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+"""
+ (c) 2017 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+
+Conversion of the issues exported from other trackers into pagure's
+tickets.
+
+The issues can be given in a CSV file (one issue per line, with the field
+names in the first line) or a JSONL file (one JSON object per line). The
+fields supported are: title (required), content, status, close_status,
+tags, assignee, author, milestone, priority, private, date_created,
+closed_at and, in JSONL only, comments.
+
+"""
+
+import csv
+import datetime
+import logging
+import uuid
+
+import pag_off.codec
+import pag_off.exceptions
+import pag_off.utils
+
+
+_log = logging.getLogger(__name__)
+
+FORMATS = ['csv', 'jsonl']
+
+
+def read_rows(filepath, fmt=None):
+    """ Read the issues stored in the specified file.
+
+    :arg filepath: The path to the file to read
+    :type filepath: str
+    :kwarg fmt: The format of the file, either csv or jsonl. Defaults to
+        the extension of the file.
+    :type fmt: str
+    :return: A generator yielding one dict per issue
+    :rtype: generator
+    :raises pag_off.exceptions.InvalidImport: if the format is not
+        supported
+
+    """
+    if fmt is None:
+        fmt = filepath.rsplit('.', 1)[-1]
+    fmt = fmt.lower()
+    if fmt not in FORMATS:
+        raise pag_off.exceptions.InvalidImport(
+            'Format: %s is not in the list of supported formats: %s' % (
+                fmt, ', '.join(FORMATS)))
+
+    _log.info('Reading %s issues from: %s', fmt, filepath)
+    if fmt == 'csv':
+        with open(filepath, newline='') as stream:
+            for row in csv.DictReader(stream):
+                yield row
+    else:
+        with open(filepath, 'rb') as stream:
+            for line in stream:
+                if line.strip():
+                    yield pag_off.codec.loads(line)
+
+
+def _user(value, default=None):
+    """ Return the given user in the format used in the tickets. """
+    if isinstance(value, dict):
+        return value
+    if not value:
+        return default
+    return {'name': value, 'default_email': ''}
+
+
+def _list(value):
+    """ Return the given value as a list, splitting strings on commas. """
+    if not value:
+        return []
+    if isinstance(value, list):
+        return value
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def _date(value, default):
+    """ Return the given date as stored in the tickets. """
+    if not value:
+        return default
+    return str(pag_off.utils.to_timestamp(value))
+
+
+def row2ticket(row, ticket_id, user, now=None):
+    """ Convert the given issue into a pagure ticket.
+
+    :arg row: The issue to convert, as returned by :func:`read_rows`
+    :type row: dict
+    :arg ticket_id: The identifier to give to the ticket
+    :type ticket_id: int
+    :arg user: The user to use as author of the ticket if the issue does
+        not specify one, as: {'name': ..., 'default_email': ...}
+    :type user: dict
+    :kwarg now: The unix timestamp to use when the issue has no date
+    :type now: str
+    :return: The uid (file name) of the ticket and the ticket itself
+    :rtype: tuple
+    :raises pag_off.exceptions.InvalidImport: if the issue has no title
+
+    """
+    if not row.get('title'):
+        raise pag_off.exceptions.InvalidImport(
+            'The issue %s has no title' % row)
+    if now is None:
+        now = datetime.datetime.utcnow().strftime('%s')
+
+    status = (row.get('status') or 'Open').capitalize()
+    date_created = _date(row.get('date_created'), now)
+    closed_at = None
+    if status == 'Closed':
+        closed_at = _date(row.get('closed_at'), date_created)
+
+    priority = row.get('priority')
+    if priority in ('', None):
+        priority = None
+    else:
+        priority = int(priority)
+
+    private = row.get('private')
+    if not isinstance(private, bool):
+        private = str(private).lower() in ['1', 'true', 'yes', 'y']
+
+    ticket = {
+        'assignee': _user(row.get('assignee')),
+        'blocks': _list(row.get('blocks')),
+        'close_status': row.get('close_status') or None,
+        'closed_at': closed_at,
+        'comments': row.get('comments') or [],
+        'content': row.get('content') or '',
+        'custom_fields': [],
+        'date_created': date_created,
+        'depends': _list(row.get('depends')),
+        'id': ticket_id,
+        'last_updated': closed_at or date_created,
+        'milestone': row.get('milestone') or None,
+        'priority': priority,
+        'private': private,
+        'status': status,
+        'tags': _list(row.get('tags')),
+        'title': row['title'],
+        'user': _user(row.get('author'), default=user),
+    }
+    return uuid.uuid4().hex, ticket
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""
+ (c) 2017 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+
+git merge driver for the JSON blobs of pagure's tickets.
+
+It is registered by pag-off in the repositories it clones or updates, and
+invoked by git as:
+
+    python -m pag_off.merge %O %A %B
+
+"""
+
+import logging
+import sys
+
+import pag_off.codec
+import pag_off.utils
+
+
+_log = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def _comment_identity(comment):
+    """ Return what identifies a comment in both sides of the merge.
+    Comments made offline do not have an identifier yet so we rely on their
+    date, author and content for these.
+    """
+    if comment.get('id') is not None:
+        return (str(comment['date_created']), comment['id'])
+    return (
+        str(comment['date_created']),
+        None,
+        comment['user']['name'],
+        comment['comment'],
+    )
+
+
+def _comment_order(comment):
+    """ Key used to sort the comments by date and identifier. """
+    return (
+        pag_off.utils.to_timestamp(comment['date_created']),
+        comment.get('id') is None,
+        comment.get('id') or 0,
+    )
+
+
+def _latest_comment(comment1, comment2):
+    """ Return the most recently edited of two versions of a comment. """
+    edited1 = comment1.get('edited_on')
+    edited2 = comment2.get('edited_on')
+    if edited2 and (not edited1 or pag_off.utils.to_timestamp(edited2)
+                    > pag_off.utils.to_timestamp(edited1)):
+        return comment2
+    return comment1
+
+
+def merge_comments(base, ours, theirs):
+    """ Three-way merge of the given lists of comments.
+
+    The comments deleted on either side, ie: present in the base but
+    missing from one of the sides, are dropped, the other comments of both
+    sides are kept and sorted by date and identifier.
+
+    :arg base: The comments in the common ancestor
+    :type base: list
+    :arg ours: The comments on our side of the merge
+    :type ours: list
+    :arg theirs: The comments on their side of the merge
+    :type theirs: list
+    :return: The merged list of comments
+    :rtype: list
+
+    """
+    our_keys = set(_comment_identity(comment) for comment in ours)
+    their_keys = set(_comment_identity(comment) for comment in theirs)
+    deleted = set(
+        key for key in (_comment_identity(comment) for comment in base)
+        if key not in our_keys or key not in their_keys
+    )
+
+    comments = {}
+    for comment in ours + theirs:
+        key = _comment_identity(comment)
+        if key in deleted:
+            continue
+        if key in comments:
+            comments[key] = _latest_comment(comments[key], comment)
+        else:
+            comments[key] = comment
+    return sorted(comments.values(), key=_comment_order)
+
+
+def merge_tickets(base, ours, theirs):
+    """ Three-way merge of the given tickets.
+
+    The comments of both sides are merged together (see
+    :func:`merge_comments`), for all the other fields the side that changed
+    it compared to the base wins and if both sides changed it, the side
+    updated last wins.
+
+    :arg base: The ticket as in the common ancestor, may be empty
+    :type base: dict
+    :arg ours: The ticket on our side of the merge
+    :type ours: dict
+    :arg theirs: The ticket on their side of the merge
+    :type theirs: dict
+    :return: The merged ticket
+    :rtype: dict
+
+    """
+    ours_updated = pag_off.utils.to_timestamp(ours.get('last_updated') or 0)
+    theirs_updated = pag_off.utils.to_timestamp(
+        theirs.get('last_updated') or 0)
+    latest = theirs if theirs_updated > ours_updated else ours
+
+    merged = {}
+    for key in set(ours) | set(theirs):
+        if key == 'comments':
+            merged[key] = merge_comments(
+                base.get(key) or [], ours.get(key) or [],
+                theirs.get(key) or [])
+            continue
+
+        our_value = ours.get(key, _MISSING)
+        their_value = theirs.get(key, _MISSING)
+        base_value = base.get(key, _MISSING)
+        if our_value == their_value:
+            value = our_value
+        elif base_value == our_value:
+            value = their_value
+        elif base_value == their_value:
+            value = our_value
+        else:
+            value = latest.get(key, _MISSING)
+
+        if value is not _MISSING:
+            merged[key] = value
+
+    if ours_updated or theirs_updated:
+        merged['last_updated'] = latest['last_updated']
+
+    return merged
+
+
+def _load(filepath):
+    """ Load the ticket stored in the specified file, an empty file (no
+    common ancestor) is returned as an empty ticket.
+    """
+    with open(filepath, 'rb') as stream:
+        content = stream.read()
+    if not content.strip():
+        return {}
+    return pag_off.codec.loads(content)
+
+
+def main(argv=None):
+    """ Entry point of the merge driver, the result of the merge is written
+    in the file of our side, as expected by git.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) != 3:
+        print('Usage: python -m pag_off.merge <base> <ours> <theirs>')
+        return 2
+
+    base_path, ours_path, theirs_path = argv
+    try:
+        base = _load(base_path)
+        ours = _load(ours_path)
+        theirs = _load(theirs_path)
+    except pag_off.codec.DecodeError as err:
+        # Not something we know how to merge, let git report the conflict
+        _log.info('Could not load the files to merge: %s', err)
+        return 1
+
+    if not isinstance(ours, dict) or not isinstance(theirs, dict) \
+            or not isinstance(base, dict):
+        return 1
+
+    merged = merge_tickets(base, ours, theirs)
+    pag_off.codec.dump_file(merged, ours_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
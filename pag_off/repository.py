@@ -0,0 +1,638 @@
+# -*- coding: utf-8 -*-
+
+"""
+ (c) 2017 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+"""
+
+import bisect
+import heapq
+import logging
+import os
+import subprocess
+import tempfile
+
+import pag_off.codec
+import pag_off.exceptions
+import pag_off.utils
+
+
+_log = logging.getLogger(__name__)
+
+# File, in the git folder of the repository, in which the identifiers of
+# the tickets are indexed
+INDEX_FILE = 'pag-off-index.json'
+
+
+def ticket_matches(data, status='Open', tags=None, assignee=None,
+                   author=None, milestone=None):
+    """ Return whether the given ticket matches the given filters.
+
+    :arg data: The ticket to check
+    :type data: dict
+    :kwarg status: The status the ticket must have.
+        Can be: Open, Closed or All. Defaults to 'Open'.
+    :type status: str
+    :kwarg tags: A list of tags the issue must have.
+    :type tags: list
+    :kwarg assignee: The username of the assignee of the ticket
+    :type assignee: str
+    :kwarg author: The username of the author of the ticket
+    :type author: str
+    :kwarg milestone: The milestone of the ticket
+    :type milestone: str
+    :return: True if the ticket matches all the filters, False otherwise
+    :rtype: bool
+
+    """
+    if status.lower() != 'all':
+        if data['status'].lower() != status.lower():
+            return False
+
+    if tags:
+        for tag in tags:
+            if tag not in data['tags']:
+                return False
+
+    if assignee is not None:
+        if not data['assignee']:
+            return False
+        elif data['assignee']['name'] != assignee:
+            return False
+
+    if author is not None:
+        if data['user']['name'] != author:
+            return False
+
+    if milestone is not None:
+        if data['milestone'] != milestone:
+            return False
+
+    return True
+
+
+class TicketRepository(object):
+    """ The tickets of a project, as stored in its git repository.
+
+    The files are listed and parsed at most once per instance, every
+    command should thus go through a single instance to access the
+    tickets.
+    """
+
+    def __init__(self, folder):
+        """ Constructor.
+
+        :arg folder: The folder containing the JSON blobs of the tickets
+        :type folder: str
+
+        """
+        self.folder = folder
+        self._filepaths = None
+        # filepath: ticket data, None if the file could not be loaded
+        self._tickets = {}
+        # str(ticket id): filepath
+        self._index = {}
+        # filepath: sort keys of the ticket, see pag_off.utils.sort_keys
+        self._sort_keys = {}
+        # The persisted index of the tickets committed, see id_index
+        self._id_index = None
+
+    @classmethod
+    def for_project(cls, config, project):
+        """ Return the repository of the specified project, as located
+        using the ``location`` option of the configuration.
+
+        :arg config: The configuration of pag-off
+        :type config: configparser.ConfigParser
+        :arg project: The name of the project
+        :type project: str
+        :return: The repository of the project
+        :rtype: TicketRepository
+
+        """
+        location = os.path.expanduser(config.get('main', 'location'))
+        folder = os.path.join(location, project)
+        _log.debug('folder:         %s', folder)
+        return cls(folder)
+
+    def filepaths(self):
+        """ Return the path of all the files containing tickets. """
+        if self._filepaths is not None:
+            return self._filepaths
+
+        _log.info('Listing tickets in: %s', self.folder)
+        self._filepaths = []
+        for filename in sorted(os.listdir(self.folder)):
+            filepath = os.path.join(self.folder, filename)
+
+            if not os.path.isfile(filepath):
+                _log.debug(
+                    'Path %s does not point to a file, passing', filepath)
+                continue
+
+            if '.' in filename:
+                _log.debug(
+                    'There is a "." in the filename, that is invalid, '
+                    'passing')
+                continue
+
+            self._filepaths.append(filepath)
+
+        return self._filepaths
+
+    def _load(self, filepath):
+        """ Return the ticket stored in the specified file, parsing it only
+        if it has not been already.
+        """
+        if filepath in self._tickets:
+            return self._tickets[filepath]
+
+        _log.debug('Loading file: %s', filepath)
+        try:
+            data = pag_off.codec.load_file(filepath)
+        except pag_off.codec.DecodeError:
+            _log.info(
+                'Could not load file: %s, continuing without', filepath)
+            data = None
+
+        self._tickets[filepath] = data
+        if data is not None:
+            self._index[str(data['id'])] = filepath
+            self._sort_keys[filepath] = pag_off.utils.sort_keys(data)
+        return data
+
+    def iter_tickets(self):
+        """ Iterate over all the tickets of the repository.
+
+        :return: A generator yielding (filepath, ticket data) tuples
+        :rtype: generator
+
+        """
+        for filepath in self.filepaths():
+            data = self._load(filepath)
+            if data is not None:
+                yield filepath, data
+
+    def get(self, ticket_id):
+        """ Return the specified ticket and the path of its file.
+
+        :arg ticket_id: The identifier of the ticket
+        :type ticket_id: int or str
+        :return: The (ticket data, filepath) tuple
+        :rtype: tuple
+        :raises pag_off.exceptions.TicketNotFound: if there is no such
+            ticket in the repository
+
+        """
+        filepath = self._index.get(str(ticket_id))
+        if filepath is not None:
+            return self._tickets[filepath], filepath
+
+        for filepath, data in self.iter_tickets():
+            if str(data['id']) == str(ticket_id):
+                return data, filepath
+
+        raise pag_off.exceptions.TicketNotFound(
+            'No ticket #%s found in: %s' % (ticket_id, self.folder))
+
+    def get_file(self, filename):
+        """ Return the ticket stored in the specified file of the
+        repository, None if there is no such file or it could not be
+        loaded.
+
+        :arg filename: The name of the file (ie: the uid of the ticket)
+        :type filename: str
+        :return: The ticket data
+        :rtype: dict
+
+        """
+        filepath = os.path.join(self.folder, filename)
+        if filepath not in self._tickets and not os.path.isfile(filepath):
+            return None
+        return self._load(filepath)
+
+    def refresh(self, filenames):
+        """ Reload the specified files, which changed on disk since they
+        were loaded.
+
+        :arg filenames: The names of the files which changed
+        :type filenames: iterable of str
+        :return: For each ticket file which changed, the ticket before and
+            after the change (None if the file did not exist or could not
+            be loaded): { filepath: (old ticket, new ticket) }
+        :rtype: dict
+
+        """
+        filepaths = self.filepaths()
+        output = {}
+        for filename in filenames:
+            if '.' in filename or '/' in filename:
+                continue
+            filepath = os.path.join(self.folder, filename)
+            old = self._tickets.pop(filepath, None)
+            self._sort_keys.pop(filepath, None)
+            if old is not None \
+                    and self._index.get(str(old['id'])) == filepath:
+                del self._index[str(old['id'])]
+
+            new = None
+            if os.path.isfile(filepath):
+                if filepath not in filepaths:
+                    filepaths.append(filepath)
+                new = self._load(filepath)
+            elif filepath in filepaths:
+                filepaths.remove(filepath)
+
+            if old is not None or new is not None:
+                output[filepath] = (old, new)
+        return output
+
+    def filter(self, status='Open', tags=None, assignee=None, author=None,
+               milestone=None):
+        """ Return the tickets matching the given filters, see
+        :func:`ticket_matches` for the filters.
+
+        :return: The ticket data in a dict which key in the ticket
+            identifier
+        :rtype: dict
+
+        """
+        return {
+            data['id']: data
+            for _, data in self.iter_tickets()
+            if ticket_matches(
+                data, status=status, tags=tags, assignee=assignee,
+                author=author, milestone=milestone)
+        }
+
+    def sorted_tickets(self, sort='newer', limit=None, **filters):
+        """ Return the tickets matching the given filters in the specified
+        order, see :func:`ticket_matches` for the filters.
+
+        The sort keys are computed when the tickets are loaded and when a
+        limit is given, only the top tickets are kept in a bounded heap
+        instead of sorting all of them.
+
+        :kwarg sort: The sort order, one of the keys of
+            ``pag_off.utils.SORT_ORDERS``. Defaults to 'newer'.
+        :type sort: str
+        :kwarg limit: The maximum number of tickets to return
+        :type limit: int
+        :return: The ticket data, in the order to show them
+        :rtype: list
+
+        """
+        keyed = (
+            (self._sort_keys[filepath][sort], filepath)
+            for filepath, data in self.iter_tickets()
+            if ticket_matches(data, **filters)
+        )
+        if limit is not None:
+            ordered = heapq.nlargest(limit, keyed)
+        else:
+            ordered = sorted(keyed, reverse=True)
+        return [self._tickets[filepath] for _, filepath in ordered]
+
+    def field_values(self, field):
+        """ Return the list of the values used in the tickets for the
+        specified field.
+
+        :arg field: The field to search for in the tickets
+        :type field: str
+        :return: The values found in the tickets for the given field
+        :rtype: list
+
+        """
+        output = set()
+        for _, data in self.iter_tickets():
+            if data.get(field):
+                output.add(data[field])
+        return list(output)
+
+    def _git_path(self, name):
+        """ Return the path of the specified file in the git folder of the
+        repository. """
+        git_dir = pag_off.utils._run_shell_cmd(
+            ['git', 'rev-parse', '--git-dir'],
+            directory=self.folder, return_stdout=True).decode('utf-8')
+        return os.path.join(self.folder, git_dir, name)
+
+    def _head(self):
+        """ Return the commit at the HEAD of the repository, None if the
+        repository is empty. """
+        try:
+            return pag_off.utils._run_shell_cmd(
+                ['git', 'rev-parse', '--verify', '--quiet', 'HEAD'],
+                directory=self.folder, return_stdout=True).decode('utf-8')
+        except Exception:
+            return None
+
+    def _load_id_index(self):
+        """ Return the index of the identifiers of the tickets as last
+        persisted, without bringing it up to date. """
+        if self._id_index is None:
+            self._id_index = {'head': None, 'ids': {}}
+            index_path = self._git_path(INDEX_FILE)
+            if os.path.exists(index_path):
+                try:
+                    self._id_index = pag_off.codec.load_file(index_path)
+                except pag_off.codec.DecodeError:
+                    _log.info('Invalid index: %s, starting over', index_path)
+        return self._id_index
+
+    def _save_id_index(self):
+        """ Persist the index of the identifiers of the tickets. """
+        with open(self._git_path(INDEX_FILE), 'wb') as stream:
+            stream.write(pag_off.codec.dumps_compact(self._id_index))
+
+    def id_index(self):
+        """ Return the identifiers of the tickets committed in the
+        repository.
+
+        The index is persisted in the git folder of the repository, only
+        the tickets changed in the commits made since it was last updated
+        are parsed to bring it up to date.
+
+        :return: The identifier of each ticket: { uid: ticket id }
+        :rtype: dict
+
+        """
+        index = self._load_id_index()
+        head = self._head()
+        if index['head'] == head:
+            return index['ids']
+
+        changed = None
+        if index['head']:
+            try:
+                changed = pag_off.utils._run_shell_cmd(
+                    ['git', 'diff', '--name-only', '--no-renames',
+                     index['head'], head, '--'],
+                    directory=self.folder, return_stdout=True)
+                _log.debug('Updating the index from %s to %s',
+                           index['head'], head)
+            except Exception:
+                # The commit is no longer in the repository
+                _log.debug('Could not update the index from %s',
+                           index['head'])
+        if changed is None:
+            _log.debug('Indexing all the tickets of %s', head)
+            index['ids'] = {}
+            changed = pag_off.utils._run_shell_cmd(
+                ['git', 'ls-tree', '--name-only', head],
+                directory=self.folder, return_stdout=True)
+
+        for filename in changed.decode('utf-8').splitlines():
+            if '.' in filename or '/' in filename:
+                continue
+            index['ids'].pop(filename, None)
+            data = self.get_file(filename)
+            if data is not None:
+                index['ids'][filename] = data['id']
+
+        index['head'] = head
+        self._save_id_index()
+        return index['ids']
+
+    def _add_to_id_index(self, ids, parent, head):
+        """ Record the tickets added or changed by the commit ``head``,
+        made on the top of ``parent``, in the persisted index. The index is
+        left as is if it was not up to date with ``parent``, it is then
+        updated the next time it is used. """
+        index = self._load_id_index()
+        if index['head'] != parent:
+            return
+        index['ids'].update(ids)
+        index['head'] = head
+        self._save_id_index()
+
+    def max_id(self):
+        """ Return the highest ticket identifier used in the repository, 0
+        if there are no tickets. The identifiers are read from the index
+        returned by :meth:`id_index`.
+        """
+        return max([int(_id) for _id in self.id_index().values()] or [0])
+
+    def import_tickets(self, tickets, name, email, message):
+        """ Add the given tickets to the repository in a single commit.
+
+        The tickets are streamed into a single ``git fast-import`` run
+        which stores them as blobs, the tree of the commit is then built
+        at once with ``git mktree`` (fast-import inserts the entries in
+        the tree one by one, which becomes quadratic with the number of
+        tickets since they are all at the top of the repository).
+
+        :arg tickets: The tickets to add
+        :type tickets: iterable of (uid, ticket data) tuples
+        :arg name: The name of the committer
+        :type name: str
+        :arg email: The email address of the committer
+        :type email: str
+        :arg message: The commit message
+        :type message: str
+        :return: The number of tickets imported
+        :rtype: int
+
+        """
+        try:
+            parent = pag_off.utils._run_shell_cmd(
+                ['git', 'rev-parse', '--verify', '--quiet', 'HEAD'],
+                directory=self.folder, return_stdout=True).decode('utf-8')
+        except Exception:
+            # Empty repository
+            parent = None
+
+        marks_fd, marks_path = tempfile.mkstemp(prefix='pag-off-marks-')
+        os.close(marks_fd)
+        try:
+            _log.debug('Running git fast-import on:        %s', self.folder)
+            proc = subprocess.Popen(
+                ['git', 'fast-import', '--quiet', '--done',
+                 '--export-marks=%s' % marks_path],
+                stdin=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=self.folder)
+            uids = []
+            ids = {}
+            try:
+                for uid, ticket in tickets:
+                    uids.append(uid)
+                    ids[uid] = ticket['id']
+                    blob = pag_off.codec.dumps(ticket)
+                    proc.stdin.write(b'blob\nmark :%d\ndata %d\n%s\n' % (
+                        len(uids), len(blob), blob))
+                proc.stdin.write(b'done\n')
+            finally:
+                proc.stdin.close()
+                stderr = proc.stderr.read()
+                proc.wait()
+            if proc.returncode != 0:
+                raise Exception(
+                    'The command "git fast-import" failed with "%s"' %
+                    stderr)
+
+            with open(marks_path) as stream:
+                marks = dict(line.split() for line in stream)
+        finally:
+            os.unlink(marks_path)
+
+        if not uids:
+            return 0
+
+        entries = []
+        if parent:
+            entries.append(pag_off.utils._run_shell_cmd(
+                ['git', 'ls-tree', '-z', parent],
+                directory=self.folder, return_stdout=True).rstrip(b'\0'))
+        entries.extend(
+            b'100644 blob %s\t%s' % (
+                marks[':%d' % mark].encode('utf-8'), uid.encode('utf-8'))
+            for mark, uid in enumerate(uids, start=1)
+        )
+        tree = pag_off.utils._run_shell_cmd(
+            ['git', 'mktree', '-z'], directory=self.folder,
+            return_stdout=True, stdin=b'\0'.join(entries) + b'\0')
+
+        command = [
+            'git', '-c', 'user.name=%s' % name, '-c', 'user.email=%s' % email,
+            'commit-tree', tree.decode('utf-8'), '-m', message]
+        if parent:
+            command.extend(['-p', parent])
+        commit = pag_off.utils._run_shell_cmd(
+            command, directory=self.folder, return_stdout=True)
+
+        command = ['git', 'update-ref', 'HEAD', commit.decode('utf-8')]
+        if parent:
+            command.append(parent)
+        pag_off.utils._run_shell_cmd(command, directory=self.folder)
+
+        # Bring the index and the working tree up to date with the new
+        # commit, leaving any local modification untouched
+        command = ['git', 'read-tree', '-m', '-u']
+        if parent:
+            command.append(parent)
+        command.append('HEAD')
+        pag_off.utils._run_shell_cmd(command, directory=self.folder)
+
+        self._filepaths = None
+        self._add_to_id_index(ids, parent, commit.decode('utf-8'))
+        return len(uids)
+
+    def update(self):
+        """ Rebase the local changes on the top of the changes made
+        upstream, the tickets loaded so far are forgotten.
+        """
+        pag_off.utils.register_merge_driver(self.folder)
+        _log.debug('Running git pull --rebase on:        %s', self.folder)
+        pag_off.utils._run_shell_cmd(
+            ['git', 'pull', '--rebase'],
+            directory=self.folder
+        )
+        self._filepaths = None
+        self._tickets = {}
+        self._index = {}
+        self._sort_keys = {}
+        self._id_index = None
+
+    def save(self, ticket, filepath, message):
+        """ Write the given ticket in the specified file and commit it.
+
+        :arg ticket: The ticket to save
+        :type ticket: dict
+        :arg filepath: The path of the file of the ticket
+        :type filepath: str
+        :arg message: The commit message
+        :type message: str
+
+        """
+        pag_off.codec.dump_file(ticket, filepath)
+        self._tickets[filepath] = ticket
+        self._index[str(ticket['id'])] = filepath
+        self._sort_keys[filepath] = pag_off.utils.sort_keys(ticket)
+        folder, uid = filepath.rsplit('/', 1)
+        parent = self._head()
+        pag_off.utils._run_shell_cmd(
+            ['git', 'commit', '-m', message, uid],
+            directory=folder
+        )
+        self._add_to_id_index({uid: ticket['id']}, parent, self._head())
+
+
+class MatchingTickets(object):
+    """ The tickets of a repository matching some filters, kept sorted and
+    updated incrementally from the changes reported by
+    :meth:`TicketRepository.refresh`.
+    """
+
+    def __init__(self, repo, sort='newer', **filters):
+        """ Constructor.
+
+        :arg repo: The repository of the tickets
+        :type repo: TicketRepository
+        :kwarg sort: The sort order, one of the keys of
+            ``pag_off.utils.SORT_ORDERS``. Defaults to 'newer'.
+        :type sort: str
+        :kwarg filters: The filters the tickets must match, see
+            :func:`ticket_matches`
+
+        """
+        self.repo = repo
+        self.sort = sort
+        self.filters = filters
+        # filepath: sort key, of the tickets matching
+        self._keys = {}
+        # (sort key, filepath) of the tickets matching, in ascending order
+        self._sorted = []
+        self.rebuild()
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def rebuild(self):
+        """ Go through all the tickets of the repository again. """
+        self._keys = {
+            filepath: self.repo._sort_keys[filepath][self.sort]
+            for filepath, data in self.repo.iter_tickets()
+            if ticket_matches(data, **self.filters)
+        }
+        self._sorted = sorted(
+            (key, filepath) for filepath, key in self._keys.items())
+
+    def update(self, changes):
+        """ Update the tickets matching with the given changes, only the
+        tickets which changed are checked against the filters.
+
+        :arg changes: The changes as returned by
+            :meth:`TicketRepository.refresh`
+        :type changes: dict
+
+        """
+        for filepath, (_, new) in changes.items():
+            key = self._keys.pop(filepath, None)
+            if key is not None:
+                del self._sorted[
+                    bisect.bisect_left(self._sorted, (key, filepath))]
+            if new is not None and ticket_matches(new, **self.filters):
+                key = self.repo._sort_keys[filepath][self.sort]
+                self._keys[filepath] = key
+                bisect.insort(self._sorted, (key, filepath))
+
+    def top(self, limit=None):
+        """ Return the first tickets in the sort order.
+
+        :kwarg limit: The maximum number of tickets to return
+        :type limit: int
+        :return: The ticket data, in the order to show them
+        :rtype: list
+
+        """
+        selected = self._sorted
+        if limit is not None:
+            selected = selected[len(selected) - limit:] if limit > 0 else []
+        return [
+            self.repo._tickets[filepath]
+            for _, filepath in reversed(selected)
+        ]
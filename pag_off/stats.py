@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+"""
+ (c) 2017 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+
+Aggregations over the set of tickets of a project.
+
+The tickets are first turned into columns (one array per field, the strings
+being interned into integer identifiers) over which the statistics are then
+computed. NumPy is used when it is available, otherwise we fall back to
+plain python.
+
+"""
+
+import bisect
+import collections
+import logging
+import math
+import time
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+import pag_off.utils
+
+
+_log = logging.getLogger(__name__)
+
+STATUS_OPEN = 0
+STATUS_CLOSED = 1
+
+DAY = 24 * 60 * 60
+# Upper bounds of the buckets used for the histogram of the age of the
+# open tickets
+AGE_BUCKETS = [
+    ('< 1 week', 7 * DAY),
+    ('< 1 month', 30 * DAY),
+    ('< 3 months', 91 * DAY),
+    ('< 1 year', 365 * DAY),
+    ('>= 1 year', float('inf')),
+]
+
+
+def _intern(value, table):
+    """ Return the integer identifier of the given value in the given
+    table, adding it if needed. None and empty values are returned as -1.
+    """
+    if value is None or value == '' or str(value) == 'None':
+        return -1
+    value = str(value)
+    if value not in table:
+        table[value] = len(table)
+    return table[value]
+
+
+def _names(table):
+    """ Return the list of values of the given interning table, indexed by
+    their identifier. """
+    names = [None] * len(table)
+    for name, idx in table.items():
+        names[idx] = name
+    return names
+
+
+def build_columns(tickets):
+    """ Build the columns used to compute the statistics from the given
+    tickets.
+
+    :arg tickets: The tickets as returned by
+        :meth:`pag_off.repository.TicketRepository.filter`
+    :type tickets: dict
+    :return: A dict containing one array (or list if numpy is not
+        available) per column: ``ids``, ``created``, ``closed`` (-1 if not
+        known), ``status``, ``assignee``, ``milestone`` as well as
+        ``tag_ticket`` and ``tag`` which list the (ticket, tag) pairs, the
+        ticket being given as its row. The ``tags``, ``assignees`` and
+        ``milestones`` keys list the names of the interned identifiers.
+    :rtype: dict
+
+    """
+    tags = {}
+    assignees = {}
+    milestones = {}
+
+    columns = collections.defaultdict(list)
+    for row, key in enumerate(sorted(tickets)):
+        data = tickets[key]
+        columns['ids'].append(int(data['id']))
+        columns['created'].append(
+            pag_off.utils.to_timestamp(data['date_created']))
+        closed_at = data.get('closed_at')
+        columns['closed'].append(
+            pag_off.utils.to_timestamp(closed_at) if closed_at else -1)
+        columns['status'].append(
+            STATUS_OPEN if data['status'].lower() == 'open'
+            else STATUS_CLOSED)
+        assignee = data.get('assignee')
+        columns['assignee'].append(
+            _intern(assignee['name'] if assignee else None, assignees))
+        columns['milestone'].append(
+            _intern(data.get('milestone'), milestones))
+        for tag in data.get('tags') or []:
+            columns['tag_ticket'].append(row)
+            columns['tag'].append(_intern(tag, tags))
+
+    output = {}
+    for name in [
+            'ids', 'created', 'closed', 'status', 'assignee', 'milestone',
+            'tag_ticket', 'tag']:
+        values = columns[name]
+        output[name] = numpy.array(values, dtype=numpy.int64) \
+            if numpy is not None else values
+    output['tags'] = _names(tags)
+    output['assignees'] = _names(assignees)
+    output['milestones'] = _names(milestones)
+    return output
+
+
+def _percentile(values, percent):
+    """ Return the given percentile of the given sorted values, using
+    linear interpolation between the closest ranks (as numpy does).
+    """
+    if not values:
+        return None
+    rank = (len(values) - 1) * percent / 100.0
+    low = int(math.floor(rank))
+    high = int(math.ceil(rank))
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def _compute_numpy(columns, now, percentiles):
+    """ Compute the statistics using numpy. """
+    status = columns['status']
+    is_open = status == STATUS_OPEN
+
+    def _count(values, mask, size):
+        values = values[mask & (values >= 0)]
+        return numpy.bincount(values, minlength=size).tolist()
+
+    tag_open = is_open[columns['tag_ticket']] \
+        if len(columns['tag_ticket']) else numpy.zeros(0, dtype=bool)
+
+    closed_mask = (status == STATUS_CLOSED) & (columns['closed'] >= 0)
+    to_close = columns['closed'][closed_mask] - columns['created'][closed_mask]
+    ages = now - columns['created'][is_open]
+
+    edges = [0] + [bound for _, bound in AGE_BUCKETS]
+    # The tickets created after now (clock skew) go in the first bucket
+    histogram = numpy.histogram(
+        numpy.maximum(ages, 0), bins=edges)[0].tolist() \
+        if len(ages) else [0] * len(AGE_BUCKETS)
+
+    return {
+        'total': int(len(status)),
+        'open': int(is_open.sum()),
+        'open_per_tag': _count(
+            columns['tag'], tag_open, len(columns['tags'])),
+        'open_per_assignee': _count(
+            columns['assignee'], is_open, len(columns['assignees'])),
+        'open_per_milestone': _count(
+            columns['milestone'], is_open, len(columns['milestones'])),
+        'unassigned': int((is_open & (columns['assignee'] < 0)).sum()),
+        'median_to_close': float(numpy.median(to_close))
+        if len(to_close) else None,
+        'age_percentiles': [
+            float(value) for value in numpy.percentile(ages, percentiles)
+        ] if len(ages) else [None] * len(percentiles),
+        'age_histogram': histogram,
+    }
+
+
+def _compute_python(columns, now, percentiles):
+    """ Compute the statistics in plain python. """
+    status = columns['status']
+    is_open = [value == STATUS_OPEN for value in status]
+
+    def _count(values, mask, size):
+        counts = [0] * size
+        for value, keep in zip(values, mask):
+            if keep and value >= 0:
+                counts[value] += 1
+        return counts
+
+    tag_open = [is_open[row] for row in columns['tag_ticket']]
+
+    to_close = sorted(
+        closed - created
+        for closed, created, code in zip(
+            columns['closed'], columns['created'], status)
+        if code == STATUS_CLOSED and closed >= 0
+    )
+    ages = sorted(
+        now - created
+        for created, keep in zip(columns['created'], is_open)
+        if keep
+    )
+
+    bounds = [bound for _, bound in AGE_BUCKETS]
+    histogram = [0] * len(AGE_BUCKETS)
+    for age in ages:
+        histogram[min(
+            bisect.bisect_right(bounds, age), len(AGE_BUCKETS) - 1)] += 1
+
+    return {
+        'total': len(status),
+        'open': sum(is_open),
+        'open_per_tag': _count(
+            columns['tag'], tag_open, len(columns['tags'])),
+        'open_per_assignee': _count(
+            columns['assignee'], is_open, len(columns['assignees'])),
+        'open_per_milestone': _count(
+            columns['milestone'], is_open, len(columns['milestones'])),
+        'unassigned': sum(
+            1 for value, keep in zip(columns['assignee'], is_open)
+            if keep and value < 0),
+        'median_to_close': _percentile(to_close, 50),
+        'age_percentiles': [
+            _percentile(ages, percent) for percent in percentiles],
+        'age_histogram': histogram,
+    }
+
+
+def compute_stats(columns, now=None, percentiles=(50, 90)):
+    """ Compute the statistics of the tickets from their columns.
+
+    :arg columns: The columns as returned by :func:`build_columns`
+    :type columns: dict
+    :kwarg now: The unix timestamp used to compute the age of the tickets,
+        defaults to the current time
+    :type now: int
+    :kwarg percentiles: The percentiles of the age of the open tickets to
+        compute
+    :type percentiles: tuple
+    :return: A dict containing: ``total``, ``open``, ``unassigned``,
+        ``open_per_tag``, ``open_per_assignee``, ``open_per_milestone``
+        (the number of open tickets indexed as the corresponding names in
+        the columns), ``median_to_close`` (in seconds), ``age_percentiles``
+        (in seconds) and ``age_histogram`` (indexed as ``AGE_BUCKETS``)
+    :rtype: dict
+
+    """
+    if now is None:
+        now = int(time.time())
+    if numpy is not None:
+        _log.debug('Computing the stats using numpy')
+        return _compute_numpy(columns, now, percentiles)
+    _log.debug('Computing the stats using python')
+    return _compute_python(columns, now, percentiles)
+
+
+def duration2str(seconds):
+    """ Return the given duration in a human-friendly format. """
+    if seconds is None:
+        return ''
+    days = seconds / DAY
+    if days >= 1:
+        return '%.1f days' % days
+    return '%.1f hours' % (seconds / 3600.0)
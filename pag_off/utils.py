@@ -9,10 +9,11 @@
 """
 
 import datetime
-import json
 import logging
 import os
+import shlex
 import subprocess
+import sys
 
 import arrow
 
@@ -20,16 +21,18 @@ import arrow
 _log = logging.getLogger(__name__)
 
 
-def _run_shell_cmd(command, directory, return_stdout=False):
-    """ Invoke the specified shall command
+def _run_shell_cmd(command, directory, return_stdout=False, stdin=None):
+    """ Invoke the specified shall command, optionally feeding it the
+    specified bytes on its standard input.
 
     """
     proc = subprocess.Popen(
         command,
+        stdin=subprocess.PIPE if stdin is not None else None,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         cwd=directory)
-    stdout, stderr = proc.communicate()
+    stdout, stderr = proc.communicate(stdin)
     if proc.returncode != 0:
         error_msg = ('The command "{0}" failed with "{1}"'
                      .format(' '.join(command), stderr))
@@ -38,148 +41,145 @@ def _run_shell_cmd(command, directory, return_stdout=False):
         return stdout.strip()
 
 
-def load_tickets(ticket_fold, status='Open', ticket_id=None, tags=None,
-                 assignee=None, author=None, milestone=None):
-    """ Load the tickets present in the specified folder, filter them with
-    the given filters and return a dict of
-        { ticket_id: ticket_data }
-
-    :kwarg ticket_fold: The folder containing the JSON blobs of the tickets
-        to load
-    :type ticket_fold: str
-    :kwarg status: The status to filter the issues returned with.
-        Can be: Open, Closed or All. Defaults to 'Open'.
-        This filter is un-used when searching a specifying a ticket_id.
-    :type status: str
-    :kwarg ticket_id: The identifier of the issue to return.
-    :type ticket_id: int or str
-    :kwarg tags: A list of tags the issue must have to be returned.
-    :type tags: list
-    :kwarg assignee: The username of the assignee of the tickets to return
-    :type assignee: str
-    :kwarg author: The username of the author of the tickets to return
-    :type author: str
-    :kwarg milestone: The milestone of the tickets to return
-    :type milestone: str
-    :return: The ticket data in a dict which key in the ticket identifier
-    :rtype: dict
+def clone_repo(url, folder, filter_spec=None, depth=None, sparse=False):
+    """ Clone the git repository at the specified url into the specified
+    folder.
+
+    :arg url: The url of the git repository to clone
+    :type url: str
+    :arg folder: The folder in which to clone the repository
+    :type folder: str
+    :kwarg filter_spec: A partial clone filter to give to git, for example:
+        ``blob:none`` to only download the content of the files as needed
+    :type filter_spec: str
+    :kwarg depth: Only retrieve this number of commits from the history
+    :type depth: int
+    :kwarg sparse: Only check out the files at the top of the repository,
+        ie: the tickets themselves and not their attachments
+    :type sparse: bool
 
     """
-    _log.info('Loading tickets from: %s', ticket_fold)
+    command = ['git', 'clone', '--quiet']
+    if filter_spec:
+        command.append('--filter=%s' % filter_spec)
+    if depth:
+        command.append('--depth=%s' % depth)
+    if sparse:
+        command.append('--sparse')
+    command.extend([url, folder])
+    _log.debug('Running: %s', ' '.join(command))
+    _run_shell_cmd(command, directory=None)
 
-    tickets = {}
 
-    for filename in os.listdir(ticket_fold):
-        filepath = os.path.join(ticket_fold, filename)
+MERGE_DRIVER = 'pag-off'
 
-        if not os.path.isfile(filepath):
-            _log.debug(
-                'Path %s does not point to a file, passing', filepath)
-            continue
 
-        if '.' in filename:
-            _log.debug(
-                'There is a "." in the filename, that is invalid, passing')
-            continue
+def register_merge_driver(folder):
+    """ Register pag-off's merge driver for the tickets in the git
+    repository present in the specified folder, so rebasing local changes
+    on the top of changes made upstream does not end up in conflicts.
 
-        _log.debug('Loading file: %s', filepath)
-        try:
-            with open(filepath) as stream:
-                data = json.load(stream)
-        except json.decoder.JSONDecodeError:
-            _log.info(
-                'Could not load file: %s, continuing without', filepath)
-        _id = data['id']
-
-        if str(_id) == str(ticket_id):
-            return (data, filepath)
-
-        if status != 'all':
-            if data['status'].lower() != status.lower():
-                continue
-
-        if tags:
-            ext = False
-            for tag in tags:
-                if tag not in data['tags']:
-                    ext = True
-                    break
-            if ext:
-                continue
-
-        if assignee is not None:
-            if not data['assignee']:
-                continue
-            elif data['assignee']['name'] != assignee:
-                continue
-
-        if author is not None:
-            if data['user']['name'] != author:
-                continue
-
-        if milestone is not None:
-            if data['milestone'] != milestone:
-                continue
-
-        tickets[_id] = data
-
-    return tickets
-
-
-def get_field_tickets(ticket_fold, field):
-    """ From all the tickets present in the specified folder, return the
-    list of value for the specified field.
-
-    :arg ticket_fold: The folder containing the JSON blobs of the tickets
-        to load
-    :type ticket_fold: str
-    :arg field: The field to search for in the tickets
-    :type field: str
-    :return: The values found in the ticket for the given field
-    :rtype: list
+    :arg folder: The folder containing the git repository
+    :type folder: str
 
     """
-    _log.info('Loading tickets from: %s', ticket_fold)
-
-    output = set()
-
-    for filename in os.listdir(ticket_fold):
-        filepath = os.path.join(ticket_fold, filename)
+    _run_shell_cmd(
+        ['git', 'config', 'merge.%s.name' % MERGE_DRIVER,
+         'pag-off ticket merge driver'],
+        directory=folder)
+    _run_shell_cmd(
+        ['git', 'config', 'merge.%s.driver' % MERGE_DRIVER,
+         '"%s" -m pag_off.merge %%O %%A %%B' % sys.executable],
+        directory=folder)
+
+    git_dir = _run_shell_cmd(
+        ['git', 'rev-parse', '--git-dir'],
+        directory=folder, return_stdout=True).decode('utf-8')
+    info_dir = os.path.join(folder, git_dir, 'info')
+    attributes = os.path.join(info_dir, 'attributes')
+    # Only the tickets, at the top of the repository, are JSON blobs: the
+    # pattern does not match the attachments stored in sub-folders
+    line = '/* merge=%s' % MERGE_DRIVER
+    lines = []
+    if os.path.exists(attributes):
+        with open(attributes) as stream:
+            lines = stream.read().splitlines()
+        if line in lines:
+            return
+    # Pattern registered by the previous versions, which also matched the
+    # attachments
+    lines = [
+        entry for entry in lines if entry != '* merge=%s' % MERGE_DRIVER]
+    lines.append(line)
+    if not os.path.exists(info_dir):
+        os.makedirs(info_dir)
+    _log.debug('Registering the merge driver in: %s', attributes)
+    with open(attributes, 'w') as stream:
+        stream.write('\n'.join(lines) + '\n')
+
+
+def _priority_key(data):
+    """ Sort key putting the tickets with the highest priority (ie: the
+    lowest value) first and the tickets without priority last. """
+    priority = data.get('priority')
+    try:
+        priority = int(priority)
+    except (TypeError, ValueError):
+        return (False, 0, int(data['id']))
+    return (True, -priority, int(data['id']))
+
+
+# For each sort order, the function returning the key of a ticket, the
+# tickets with the largest keys are shown first.
+SORT_ORDERS = {
+    'newer': lambda data: int(data['id']),
+    'older': lambda data: -int(data['id']),
+    'updated': lambda data: (
+        to_timestamp(data.get('last_updated') or 0), int(data['id'])),
+    'created': lambda data: (
+        to_timestamp(data['date_created']), int(data['id'])),
+    'priority': _priority_key,
+    'comments': lambda data: (
+        len(data.get('comments') or []), int(data['id'])),
+}
+
+
+def sort_keys(data):
+    """ Return the sort keys of the given ticket.
+
+    :arg data: The ticket
+    :type data: dict
+    :return: The key of the ticket for each of the sort orders of
+        ``SORT_ORDERS``: { sort order: key }
+    :rtype: dict
 
-        if not os.path.isfile(filepath):
-            _log.debug(
-                'Path %s does not point to a file, passing', filepath)
-            continue
+    """
+    return {sort: sort_key(data) for sort, sort_key in SORT_ORDERS.items()}
 
-        if '.' in filename:
-            _log.debug(
-                'There is a "." in the filename, that is invalid, passing')
-            continue
 
-        _log.debug('Loading file: %s', filepath)
-        try:
-            with open(filepath) as stream:
-                data = json.load(stream)
-        except json.decoder.JSONDecodeError:
-            _log.info(
-                'Could not load file: %s, continuing without', filepath)
+def humanize(date):
+    """ Make the date human-friendly. """
+    if date:
+        return arrow.get(to_timestamp(date)).humanize()
 
-        if field in data:
-            if data[field]:
-                output.add(data[field])
 
-    return list(output)
+def to_timestamp(date):
+    """ Return the given date as a unix timestamp (int).
 
+    :arg date: The date to convert, either a unix timestamp (as stored in
+        the JSON blobs of the tickets) or a date string understood by arrow
+        (ie: 2017-03-01)
+    :type date: int or str
+    :return: The corresponding unix timestamp
+    :rtype: int
 
-def humanize(date):
-    """ Make the date human-friendly. """
-    if date:
-        return arrow.get(date).humanize()
+    """
+    if isinstance(date, int) or str(date).isdigit():
+        return int(date)
+    return int(float(arrow.get(date).format('X')))
 
 
-def ticket2str(ticket):
-    """ Return a string to display a ticket to the user. """
-    tmpl = """#{id}: {title}
+TICKET_TMPL = """#{id}: {title}
 
 From:       {user}
 Date:       {date_created}
@@ -193,7 +193,34 @@ Depends:    {depends}
 Milestone:  {milestone}
 Last update:{last_updated}
 
-{content}""".format(**{
+{content}"""
+
+COMMENT_TMPL = """
+        --------------------
+* {user}  -- {date}
+
+{comment}"""
+
+
+def ticket2chunks(ticket, last=None, since=None, comments=True):
+    """ Generate the text to display a ticket to the user, one section at
+    a time so the caller can output it as it is produced.
+
+    :arg ticket: The ticket to display
+    :type ticket: dict
+    :kwarg last: If specified, only show this many of the latest comments
+    :type last: int
+    :kwarg since: If specified, only show the comments made at or after this
+        unix timestamp
+    :type since: int
+    :kwarg comments: Whether to show the comments at all. Defaults to True.
+    :type comments: bool
+    :return: A generator yielding the header of the ticket and then each of
+        the comments selected
+    :rtype: generator of str
+
+    """
+    yield TICKET_TMPL.format(**{
         'id': ticket['id'],
         'title': ticket['title'],
         'date_created': humanize(ticket['date_created']),
@@ -210,22 +237,72 @@ Last update:{last_updated}
         'content': ticket['content'],
     })
 
-    for comment in ticket['comments']:
-        d = {
+    if not comments:
+        return
+
+    selected = ticket['comments']
+    if since is not None:
+        selected = [
+            comment for comment in selected
+            if to_timestamp(comment['date_created']) >= since
+        ]
+    if last is not None:
+        selected = selected[-last:] if last > 0 else []
+
+    for comment in selected:
+        yield COMMENT_TMPL.format(**{
             'user': comment['user']['name'],
             'date': humanize(comment['date_created']),
             'comment': comment['comment']
-        }
-        tmpl += """
-        --------------------
-* {user}  -- {date}
+        })
 
-{comment}""".format(**d)
 
-    return tmpl
+def ticket2str(ticket, **kwargs):
+    """ Return a string to display a ticket to the user.
+
+    The keyword arguments are passed as-is to :func:`ticket2chunks`.
+    """
+    return ''.join(ticket2chunks(ticket, **kwargs))
 
 
-def add_comment(ticket, filepath, comment, config):
+def page(chunks):
+    """ Send the given chunks of text to the user's pager (``$PAGER``,
+    defaulting to ``less``) as they are produced, or straight to stdout
+    when stdout is not a terminal or the pager cannot be run.
+
+    :arg chunks: The text to display
+    :type chunks: iterable of str
+
+    """
+    proc = None
+    if sys.stdout.isatty():
+        pager = os.environ.get('PAGER') or 'less -FRX'
+        try:
+            proc = subprocess.Popen(
+                shlex.split(pager), stdin=subprocess.PIPE,
+                universal_newlines=True)
+        except OSError as err:
+            _log.info('Could not run the pager %s: %s', pager, err)
+
+    if proc is None:
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+        sys.stdout.write('\n')
+        return
+
+    try:
+        for chunk in chunks:
+            proc.stdin.write(chunk)
+            proc.stdin.flush()
+        proc.stdin.write('\n')
+        proc.stdin.close()
+    except BrokenPipeError:
+        # The user quit the pager before the end of the output
+        _log.debug('Pager closed before the end of the output')
+    proc.wait()
+
+
+def add_comment(repo, ticket, filepath, comment, config):
     """ Adds a given comment to the specified ticket. """
     tmpl = {
         'comment': comment,
@@ -248,23 +325,14 @@ def add_comment(ticket, filepath, comment, config):
 
     ticket['last_updated'] = datetime.datetime.utcnow().strftime('%s')
 
-    with open(filepath, 'w') as stream:
-        stream.write(json.dumps(
-            ticket, sort_keys=True, indent=4,
-            separators=(',', ': '))
-        )
-    folder, uid = filepath.rsplit('/', 1)
-    _run_shell_cmd(
-        ['git', 'commit', '-m',
-         'Updated issue %s: %s' % (uid, ticket['title']),
-         uid
-         ],
-        directory=folder
-    )
+    uid = os.path.basename(filepath)
+    repo.save(
+        ticket, filepath,
+        'Updated issue %s: %s' % (uid, ticket['title']))
     return 'done'
 
 
-def take_ticke(ticket, filepath, config):
+def take_ticke(repo, ticket, filepath, config):
     """ Assign a ticket to the current user. """
     comment = "**Metadata Update from @%s**:\n"\
         "- Issue assigned to %s" % (
@@ -299,23 +367,14 @@ def take_ticke(ticket, filepath, config):
     if conf.lower() not in ['yes', 'y']:
         return 'canceled'
 
-    with open(filepath, 'w') as stream:
-        stream.write(json.dumps(
-            ticket, sort_keys=True, indent=4,
-            separators=(',', ': '))
-        )
-    folder, uid = filepath.rsplit('/', 1)
-    _run_shell_cmd(
-        ['git', 'commit', '-m',
-         'Close issue %s: %s' % (uid, ticket['title']),
-         uid
-         ],
-        directory=folder
-    )
+    uid = os.path.basename(filepath)
+    repo.save(
+        ticket, filepath,
+        'Close issue %s: %s' % (uid, ticket['title']))
     return 'done'
 
 
-def close_ticket(ticket, filepath, config, close_status=None):
+def close_ticket(repo, ticket, filepath, config, close_status=None):
     """ Close the specified ticket, potentially with the specified
     close_status.
     """
@@ -356,17 +415,8 @@ def close_ticket(ticket, filepath, config, close_status=None):
     if conf.lower() not in ['yes', 'y']:
         return 'canceled'
 
-    with open(filepath, 'w') as stream:
-        stream.write(json.dumps(
-            ticket, sort_keys=True, indent=4,
-            separators=(',', ': '))
-        )
-    folder, uid = filepath.rsplit('/', 1)
-    _run_shell_cmd(
-        ['git', 'commit', '-m',
-         'Close issue %s: %s' % (uid, ticket['title']),
-         uid
-         ],
-        directory=folder
-    )
+    uid = os.path.basename(filepath)
+    repo.save(
+        ticket, filepath,
+        'Close issue %s: %s' % (uid, ticket['title']))
     return 'done'
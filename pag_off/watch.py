@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+"""
+ (c) 2017 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+
+Watch the folder of the tickets for changes and redraw the output in place.
+
+On Linux the changes are reported by inotify (called via ctypes), on the
+other systems or if inotify is not usable, the files of the folder are
+stat'ed at regular interval.
+
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import shutil
+import struct
+import sys
+import time
+
+
+_log = logging.getLogger(__name__)
+
+# Interval, in seconds, between two scans of the folder when polling
+POLL_INTERVAL = 2
+# Interval, in seconds, after which the output is redrawn even if nothing
+# changed, so the relative dates it shows stay current
+REFRESH_INTERVAL = 60
+# Time, in seconds, to wait for more changes before reporting them, so
+# the changes made by a single git command are reported together
+SETTLE_DELAY = 0.1
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct('iIII')
+
+# Returned by the watchers instead of the names of the files changed when
+# some changes were lost, all the files must then be reloaded
+OVERFLOW = object()
+
+
+class InotifyWatcher(object):
+    """ Report the changes made to the files of a folder using inotify. """
+
+    def __init__(self, folder):
+        """ Constructor.
+
+        :arg folder: The folder to watch
+        :type folder: str
+        :raises OSError: if inotify is not available
+
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        # New files are reported once written (IN_CLOSE_WRITE) rather than
+        # when created, so they are not read half-written
+        wd = libc.inotify_add_watch(
+            self._fd, os.fsencode(folder),
+            IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, os.strerror(errno))
+
+    def _read(self, timeout):
+        """ Return the names of the files changed, waiting at most the
+        specified number of seconds (forever if None), or OVERFLOW if the
+        queue of the events overflowed. """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        buf = os.read(self._fd, 64 * 1024)
+        names = set()
+        overflow = False
+        offset = 0
+        while offset < len(buf):
+            _, mask, _, length = _EVENT.unpack_from(buf, offset)
+            offset += _EVENT.size
+            name = buf[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            elif name:
+                names.add(os.fsdecode(name))
+        return OVERFLOW if overflow else names
+
+    def wait(self, timeout=None):
+        """ Wait for changes in the folder.
+
+        :kwarg timeout: The maximum number of seconds to wait, forever if
+            None
+        :type timeout: int
+        :return: The names of the files which changed (empty if there were
+            no changes before the timeout), or OVERFLOW if some changes
+            were lost
+        :rtype: set
+
+        """
+        names = self._read(timeout)
+        more = names
+        while more:
+            more = self._read(SETTLE_DELAY)
+            if names is OVERFLOW or more is OVERFLOW:
+                names = OVERFLOW
+            else:
+                names |= more
+        return names
+
+    def close(self):
+        """ Stop watching the folder. """
+        os.close(self._fd)
+
+
+class PollingWatcher(object):
+    """ Report the changes made to the files of a folder by looking at
+    their size and modification time at regular interval. """
+
+    def __init__(self, folder, interval=POLL_INTERVAL):
+        """ Constructor.
+
+        :arg folder: The folder to watch
+        :type folder: str
+        :kwarg interval: Number of seconds between two scans of the folder
+        :type interval: int
+
+        """
+        self.folder = folder
+        self.interval = interval
+        self._state = self._scan()
+
+    def _scan(self):
+        """ Return the state of the files of the folder. """
+        state = {}
+        for entry in os.scandir(self.folder):
+            if entry.is_file():
+                stat = entry.stat()
+                state[entry.name] = (
+                    stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        return state
+
+    def wait(self, timeout=None):
+        """ Wait for changes in the folder.
+
+        :kwarg timeout: The maximum number of seconds to wait, forever if
+            None
+        :type timeout: int
+        :return: The names of the files which changed (empty if there were
+            no changes before the timeout)
+        :rtype: set
+
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(self.interval)
+            state = self._scan()
+            names = set(
+                name for name in set(state) | set(self._state)
+                if state.get(name) != self._state.get(name)
+            )
+            self._state = state
+            if names:
+                return names
+            if deadline is not None and time.monotonic() >= deadline:
+                return names
+
+    def close(self):
+        """ Stop watching the folder. """
+        pass
+
+
+def get_watcher(folder):
+    """ Return the watcher to use for the specified folder: inotify if it
+    is available, polling otherwise.
+
+    :arg folder: The folder to watch
+    :type folder: str
+    :return: The watcher of the folder
+    :rtype: InotifyWatcher or PollingWatcher
+
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError) as err:
+            _log.info('Could not use inotify: %s, polling instead', err)
+    return PollingWatcher(folder)
+
+
+class LiveDisplay(object):
+    """ Display some lines of text in the terminal, redrawing only the
+    lines which changed from one update to the next.
+    """
+
+    def __init__(self, stream=None):
+        """ Constructor.
+
+        :kwarg stream: Where to write, defaults to stdout
+        :type stream: file
+
+        """
+        self.stream = stream or sys.stdout
+        self._lines = None
+
+    def height(self):
+        """ Return the number of lines which can be displayed. """
+        return max(1, shutil.get_terminal_size().lines - 1)
+
+    def update(self, lines):
+        """ Display the given lines.
+
+        :arg lines: The lines to display, the ones which do not fit in the
+            terminal, or the part of them which does not, are left out
+        :type lines: list of str
+
+        """
+        # The lines are cut to the width of the terminal, lines wrapping
+        # over the next ones would move the lines drawn afterward
+        width = shutil.get_terminal_size().columns
+        lines = [line[:width] for line in lines[:self.height()]]
+
+        output = []
+        previous = self._lines
+        if previous is None:
+            # Clear the screen
+            output.append('\x1b[H\x1b[2J')
+            previous = []
+        for idx, line in enumerate(lines):
+            if idx >= len(previous) or previous[idx] != line:
+                output.append('\x1b[%d;1H%s\x1b[K' % (idx + 1, line))
+        if len(lines) < len(previous):
+            output.append('\x1b[%d;1H\x1b[J' % (len(lines) + 1))
+        output.append('\x1b[%d;1H' % (len(lines) + 1))
+
+        self.stream.write(''.join(output))
+        self.stream.flush()
+        self._lines = lines
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+ (c) 2017 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+
+Tests for the clone action, using local bare repositories in place of
+pagure.
+
+"""
+
+import argparse
+import configparser
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import pag_off.app
+import pag_off.exceptions
+import pag_off.utils
+
+
+def _git(folder, *args):
+    """ Run the given git command in the specified folder. """
+    subprocess.check_call(
+        ['git', '-c', 'user.name=pag-off', '-c', 'user.email=pag-off@test',
+         '-c', 'init.defaultBranch=master'] + list(args),
+        cwd=folder, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class CloneTests(unittest.TestCase):
+    """ Tests for pag_off.utils.clone_repo and pag_off.app.do_clone. """
+
+    def setUp(self):
+        """ Create a bare tickets repository for the project ``test``. """
+        self.path = tempfile.mkdtemp(prefix='pag-off-tests-')
+        self.base = os.path.join(self.path, 'pagure')
+        self.location = os.path.join(self.path, 'clones')
+        os.makedirs(os.path.join(self.base, 'tickets'))
+        os.makedirs(self.location)
+
+        work = os.path.join(self.path, 'work')
+        os.makedirs(os.path.join(work, 'files'))
+        with open(os.path.join(work, 'abcd1234'), 'w') as stream:
+            stream.write('{"id": 1}\n')
+        with open(os.path.join(work, 'files', 'screenshot'), 'w') as stream:
+            stream.write('attachment\n')
+        _git(work, 'init', '--quiet')
+        _git(work, 'add', '.')
+        _git(work, 'commit', '--quiet', '-m', 'Initial commit')
+        _git(self.path, 'clone', '--quiet', '--bare', work,
+             os.path.join(self.base, 'tickets', 'test.git'))
+
+        self.config = configparser.ConfigParser()
+        self.config.read_dict({
+            'main': {
+                'base_url': 'file://%s/' % self.base,
+                'location': self.location,
+            },
+            'user': {'name': 'pingou', 'default_email': 'foo@bar.com'},
+        })
+
+    def tearDown(self):
+        """ Remove the repositories. """
+        shutil.rmtree(self.path)
+
+    def _do_clone(self, projects, sparse=False):
+        """ Run the clone action and return what it printed. """
+        args = argparse.Namespace(
+            project=projects, repo='tickets', filter=None, depth=None,
+            sparse=sparse, jobs=2)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            pag_off.app.do_clone(args, self.config)
+        return output.getvalue()
+
+    def test_clone_repo(self):
+        """ Test cloning a repository with its attachments. """
+        folder = os.path.join(self.location, 'test')
+        pag_off.utils.clone_repo(
+            'file://%s/tickets/test.git' % self.base, folder)
+        self.assertTrue(os.path.isfile(os.path.join(folder, 'abcd1234')))
+        self.assertTrue(
+            os.path.isfile(os.path.join(folder, 'files', 'screenshot')))
+
+    def test_clone_repo_sparse(self):
+        """ Test that a sparse clone only checks out the tickets. """
+        folder = os.path.join(self.location, 'test')
+        pag_off.utils.clone_repo(
+            'file://%s/tickets/test.git' % self.base, folder, sparse=True)
+        self.assertTrue(os.path.isfile(os.path.join(folder, 'abcd1234')))
+        self.assertFalse(os.path.exists(os.path.join(folder, 'files')))
+
+    def test_clone_repo_invalid(self):
+        """ Test cloning a repository which does not exist. """
+        self.assertRaises(
+            Exception, pag_off.utils.clone_repo,
+            'file://%s/tickets/invalid.git' % self.base,
+            os.path.join(self.location, 'invalid'))
+
+    def test_do_clone(self):
+        """ Test cloning a project registers the merge driver. """
+        output = self._do_clone(['test'])
+        self.assertEqual(output, 'test cloned\n')
+
+        folder = os.path.join(self.location, 'test')
+        self.assertTrue(os.path.isfile(os.path.join(folder, 'abcd1234')))
+        driver = subprocess.check_output(
+            ['git', 'config', 'merge.pag-off.driver'], cwd=folder)
+        self.assertIn(b'pag_off.merge', driver)
+        attributes = os.path.join(folder, '.git', 'info', 'attributes')
+        with open(attributes) as stream:
+            self.assertIn('/* merge=pag-off', stream.read().splitlines())
+
+    def test_do_clone_sparse(self):
+        """ Test cloning a project without its attachments. """
+        output = self._do_clone(['test'], sparse=True)
+        self.assertEqual(output, 'test cloned\n')
+
+        folder = os.path.join(self.location, 'test')
+        self.assertTrue(os.path.isfile(os.path.join(folder, 'abcd1234')))
+        self.assertFalse(os.path.exists(os.path.join(folder, 'files')))
+
+    def test_do_clone_present(self):
+        """ Test cloning a project which has already been cloned. """
+        self._do_clone(['test'])
+        output = self._do_clone(['test'])
+        self.assertEqual(
+            output, 'test already present, use `update` instead\n')
+
+    def test_do_clone_failed(self):
+        """ Test that the other projects are cloned when one fails. """
+        args = argparse.Namespace(
+            project=['invalid', 'test'], repo='tickets', filter=None,
+            depth=None, sparse=False, jobs=2)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            with self.assertRaises(pag_off.exceptions.CloneFailed) as cm:
+                pag_off.app.do_clone(args, self.config)
+
+        self.assertEqual(str(cm.exception), 'Could not clone: invalid')
+        self.assertIn('test cloned\n', output.getvalue())
+        self.assertIn('Failed to clone invalid: ', output.getvalue())
+        self.assertTrue(
+            os.path.isfile(os.path.join(self.location, 'test', 'abcd1234')))
+        self.assertFalse(
+            os.path.exists(os.path.join(self.location, 'invalid')))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+"""
+ (c) 2017 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+
+Tests for the git merge driver of the tickets.
+
+"""
+
+import copy
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import pag_off
+import pag_off.codec
+import pag_off.merge
+import pag_off.repository
+
+
+def _git(folder, *args):
+    """ Run the given git command in the specified folder. """
+    subprocess.check_call(
+        ['git', '-c', 'user.name=pag-off', '-c', 'user.email=pag-off@test',
+         '-c', 'init.defaultBranch=master'] + list(args),
+        cwd=folder, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _comment(comment_id, date, comment, user='pingou'):
+    """ Return a comment as stored in the tickets. """
+    return {
+        'comment': comment,
+        'date_created': str(date),
+        'edited_on': None,
+        'editor': None,
+        'id': comment_id,
+        'notification': False,
+        'parent': None,
+        'user': {'name': user, 'default_email': '%s@test' % user},
+    }
+
+
+TICKET = {
+    'assignee': None,
+    'blocks': [],
+    'close_status': None,
+    'closed_at': None,
+    'comments': [_comment(1, 1000, 'First comment')],
+    'content': 'Description of the ticket',
+    'custom_fields': [],
+    'date_created': '900',
+    'depends': [],
+    'id': 1,
+    'last_updated': '1000',
+    'milestone': None,
+    'priority': None,
+    'private': False,
+    'status': 'Open',
+    'tags': [],
+    'title': 'Test ticket',
+    'user': {'name': 'pingou', 'default_email': 'pingou@test'},
+}
+
+
+class MergeTicketsTests(unittest.TestCase):
+    """ Tests for pag_off.merge.merge_tickets. """
+
+    def setUp(self):
+        """ Create the base, our and their versions of the ticket. """
+        self.base = copy.deepcopy(TICKET)
+        self.ours = copy.deepcopy(TICKET)
+        self.theirs = copy.deepcopy(TICKET)
+
+    def _comment_ids(self, ticket):
+        """ Return the (identifier, content) of the comments of a ticket.
+        """
+        return [
+            (comment['id'], comment['comment'])
+            for comment in ticket['comments']
+        ]
+
+    def test_comments_both_sides(self):
+        """ Test merging comments added on both sides. """
+        self.ours['comments'].append(_comment(3, 3000, 'Ours'))
+        self.ours['last_updated'] = '3000'
+        self.theirs['comments'].append(_comment(2, 2000, 'Theirs'))
+        self.theirs['last_updated'] = '2000'
+
+        merged = pag_off.merge.merge_tickets(
+            self.base, self.ours, self.theirs)
+        self.assertEqual(
+            self._comment_ids(merged),
+            [(1, 'First comment'), (2, 'Theirs'), (3, 'Ours')])
+        self.assertEqual(merged['last_updated'], '3000')
+
+    def test_comment_offline(self):
+        """ Test merging a comment made offline, without identifier yet,
+        with a comment made on pagure at the same time. """
+        self.ours['comments'].append(_comment(None, 2000, 'Offline'))
+        self.ours['last_updated'] = '2000'
+        self.theirs['comments'].append(_comment(2, 2000, 'Online'))
+        self.theirs['last_updated'] = '2000'
+
+        merged = pag_off.merge.merge_tickets(
+            self.base, self.ours, self.theirs)
+        self.assertEqual(
+            self._comment_ids(merged),
+            [(1, 'First comment'), (2, 'Online'), (None, 'Offline')])
+
+    def test_comment_deleted(self):
+        """ Test that a comment deleted on one side stays deleted. """
+        self.base['comments'].append(_comment(2, 2000, 'Spam'))
+        self.ours['comments'].append(_comment(2, 2000, 'Spam'))
+        self.ours['comments'].append(_comment(None, 3000, 'Offline'))
+        self.ours['last_updated'] = '3000'
+
+        merged = pag_off.merge.merge_tickets(
+            self.base, self.ours, self.theirs)
+        self.assertEqual(
+            self._comment_ids(merged),
+            [(1, 'First comment'), (None, 'Offline')])
+
+    def test_scalar_one_side(self):
+        """ Test that a field changed on one side only is kept, even if the
+        other side was updated later. """
+        self.ours['status'] = 'Closed'
+        self.ours['last_updated'] = '2000'
+        self.theirs['title'] = 'New title'
+        self.theirs['last_updated'] = '3000'
+
+        merged = pag_off.merge.merge_tickets(
+            self.base, self.ours, self.theirs)
+        self.assertEqual(merged['status'], 'Closed')
+        self.assertEqual(merged['title'], 'New title')
+        self.assertEqual(merged['last_updated'], '3000')
+
+    def test_scalar_both_sides(self):
+        """ Test that when both sides changed a field, the side updated
+        last wins. """
+        self.ours['title'] = 'Our title'
+        self.ours['last_updated'] = '3000'
+        self.theirs['title'] = 'Their title'
+        self.theirs['last_updated'] = '2000'
+
+        merged = pag_off.merge.merge_tickets(
+            self.base, self.ours, self.theirs)
+        self.assertEqual(merged['title'], 'Our title')
+
+        self.theirs['last_updated'] = '4000'
+        merged = pag_off.merge.merge_tickets(
+            self.base, self.ours, self.theirs)
+        self.assertEqual(merged['title'], 'Their title')
+        self.assertEqual(merged['last_updated'], '4000')
+
+    def test_empty_base(self):
+        """ Test merging a ticket added on both sides. """
+        self.ours['comments'].append(_comment(None, 2000, 'Offline'))
+        self.ours['last_updated'] = '2000'
+        self.theirs['title'] = 'Their title'
+        self.theirs['last_updated'] = '3000'
+
+        merged = pag_off.merge.merge_tickets({}, self.ours, self.theirs)
+        self.assertEqual(
+            self._comment_ids(merged),
+            [(1, 'First comment'), (None, 'Offline')])
+        self.assertEqual(merged['title'], 'Their title')
+        self.assertEqual(merged['content'], 'Description of the ticket')
+
+    def test_main_invalid(self):
+        """ Test that the driver lets git report a conflict on files which
+        are not JSON. """
+        path = tempfile.mkdtemp(prefix='pag-off-tests-')
+        try:
+            filepaths = []
+            for name in ['base', 'ours', 'theirs']:
+                filepath = os.path.join(path, name)
+                with open(filepath, 'wb') as stream:
+                    stream.write(b'\x89PNG %s' % name.encode('utf-8'))
+                filepaths.append(filepath)
+            self.assertEqual(pag_off.merge.main(filepaths), 1)
+            with open(filepaths[1], 'rb') as stream:
+                self.assertEqual(stream.read(), b'\x89PNG ours')
+        finally:
+            shutil.rmtree(path)
+
+
+class MergeDriverTests(unittest.TestCase):
+    """ Tests for the merge driver run by ``git pull --rebase``, using a
+    local bare repository in place of pagure. """
+
+    def setUp(self):
+        """ Create a bare tickets repository and two clones of it. """
+        self.path = tempfile.mkdtemp(prefix='pag-off-tests-')
+        # git runs the driver as: python -m pag_off.merge
+        self._pythonpath = os.environ.get('PYTHONPATH')
+        root = os.path.dirname(os.path.dirname(pag_off.__file__))
+        os.environ['PYTHONPATH'] = os.pathsep.join(
+            [root] + ([self._pythonpath] if self._pythonpath else []))
+
+        work = os.path.join(self.path, 'work')
+        os.makedirs(work)
+        self._write(work, TICKET)
+        _git(work, 'init', '--quiet')
+        _git(work, 'add', '.')
+        _git(work, 'commit', '--quiet', '-m', 'Initial commit')
+
+        self.remote = os.path.join(self.path, 'test.git')
+        _git(self.path, 'clone', '--quiet', '--bare', work, self.remote)
+
+        self.pagure = os.path.join(self.path, 'pagure')
+        self.local = os.path.join(self.path, 'local')
+        for folder in [self.pagure, self.local]:
+            _git(self.path, 'clone', '--quiet', self.remote, folder)
+            _git(folder, 'config', 'user.name', 'pag-off')
+            _git(folder, 'config', 'user.email', 'pag-off@test')
+
+    def tearDown(self):
+        """ Remove the repositories. """
+        if self._pythonpath is None:
+            del os.environ['PYTHONPATH']
+        else:
+            os.environ['PYTHONPATH'] = self._pythonpath
+        shutil.rmtree(self.path)
+
+    def _write(self, folder, ticket):
+        """ Write the given ticket in the specified folder. """
+        with open(os.path.join(folder, 'abcd1234'), 'wb') as stream:
+            stream.write(pag_off.codec.dumps(ticket))
+
+    def _read(self, folder):
+        """ Return the ticket stored in the specified folder. """
+        with open(os.path.join(folder, 'abcd1234')) as stream:
+            return json.load(stream)
+
+    def test_pull_rebase(self):
+        """ Test that updating a repository with local changes merges the
+        changes made on both sides without conflict. """
+        ticket = copy.deepcopy(TICKET)
+        ticket['comments'].append(_comment(2, 2000, 'Online'))
+        ticket['title'] = 'New title'
+        ticket['last_updated'] = '2000'
+        self._write(self.pagure, ticket)
+        _git(self.pagure, 'commit', '--quiet', '-am', 'Online comment')
+        _git(self.pagure, 'push', '--quiet')
+
+        ticket = copy.deepcopy(TICKET)
+        ticket['comments'].append(_comment(None, 3000, 'Offline'))
+        ticket['last_updated'] = '3000'
+        self._write(self.local, ticket)
+        _git(self.local, 'commit', '--quiet', '-am', 'Offline comment')
+
+        repo = pag_off.repository.TicketRepository(self.local)
+        repo.update()
+
+        ticket = self._read(self.local)
+        self.assertEqual(
+            [comment['comment'] for comment in ticket['comments']],
+            ['First comment', 'Online', 'Offline'])
+        self.assertEqual(ticket['title'], 'New title')
+        self.assertEqual(ticket['last_updated'], '3000')
+
+        subjects = subprocess.check_output(
+            ['git', 'log', '--format=%s'], cwd=self.local)
+        self.assertEqual(
+            subjects.decode('utf-8').splitlines(),
+            ['Offline comment', 'Online comment', 'Initial commit'])
+        status = subprocess.check_output(
+            ['git', 'status', '--porcelain'], cwd=self.local)
+        self.assertEqual(status, b'')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
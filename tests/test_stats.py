@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+ (c) 2017 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+
+Tests for the statistics, checking that the numpy and the plain python
+implementations agree.
+
+"""
+
+import unittest
+from unittest import mock
+
+import pag_off.stats
+
+
+DAY = pag_off.stats.DAY
+NOW = 1500000000
+
+
+def _ticket(ticket_id, age, status='Open', closed_after=None, tags=None,
+            assignee=None, milestone=None):
+    """ Return a ticket created the given number of seconds before NOW. """
+    created = NOW - age
+    return {
+        'id': ticket_id,
+        'date_created': str(created),
+        'closed_at': str(created + closed_after)
+        if closed_after is not None else None,
+        'status': status,
+        'tags': tags or [],
+        'assignee': {'name': assignee, 'default_email': ''}
+        if assignee else None,
+        'milestone': milestone,
+    }
+
+
+TICKETS = [
+    _ticket(1, 2 * DAY, tags=['easyfix', 'doc'], assignee='pingou'),
+    _ticket(2, 7 * DAY, tags=['doc'], milestone='1.0'),
+    _ticket(3, 30 * DAY, assignee='ralph', milestone='1.0'),
+    _ticket(4, 400 * DAY, tags=['easyfix']),
+    _ticket(5, 100 * DAY, status='Closed', closed_after=3 * DAY,
+            tags=['doc'], assignee='pingou', milestone='2.0'),
+    _ticket(6, 50 * DAY, status='Closed', closed_after=DAY // 2),
+    # Closed without closed_at
+    _ticket(7, 10 * DAY, status='Closed'),
+    # Created after NOW (clock skew)
+    _ticket(8, -60),
+    _ticket(9, 0),
+]
+
+
+@unittest.skipIf(pag_off.stats.numpy is None, 'numpy is not installed')
+class StatsTests(unittest.TestCase):
+    """ Tests comparing pag_off.stats._compute_numpy and
+    pag_off.stats._compute_python. """
+
+    def _compare(self, tickets):
+        """ Compute the statistics of the given tickets with both
+        implementations, check they agree and return them. """
+        tickets = dict((ticket['id'], ticket) for ticket in tickets)
+        columns = pag_off.stats.build_columns(tickets)
+        with mock.patch.object(pag_off.stats, 'numpy', None):
+            py_columns = pag_off.stats.build_columns(tickets)
+
+        for percentiles in [(50, 90), (0, 25, 100)]:
+            stats = pag_off.stats._compute_numpy(columns, NOW, percentiles)
+            py_stats = pag_off.stats._compute_python(
+                py_columns, NOW, percentiles)
+            self.assertEqual(sorted(stats), sorted(py_stats))
+            for key in stats:
+                if key in ('median_to_close', 'age_percentiles'):
+                    continue
+                self.assertEqual(stats[key], py_stats[key], key)
+            self._assert_almost_equal(
+                stats['median_to_close'], py_stats['median_to_close'])
+            self.assertEqual(
+                len(stats['age_percentiles']),
+                len(py_stats['age_percentiles']))
+            for value, py_value in zip(
+                    stats['age_percentiles'], py_stats['age_percentiles']):
+                self._assert_almost_equal(value, py_value)
+        return py_stats
+
+    def _assert_almost_equal(self, value, py_value):
+        """ Check that the two values are equal, or both None. """
+        if value is None or py_value is None:
+            self.assertEqual(value, py_value)
+        else:
+            self.assertAlmostEqual(value, py_value, places=3)
+
+    def test_tickets(self):
+        """ Test the statistics of a set of open and closed tickets. """
+        stats = self._compare(TICKETS)
+        self.assertEqual(stats['total'], 9)
+        self.assertEqual(stats['open'], 6)
+        self.assertEqual(stats['unassigned'], 4)
+        self.assertEqual(stats['median_to_close'], 1.75 * DAY)
+        # The ages exactly on the edge of a bucket go in the next bucket
+        self.assertEqual(stats['age_histogram'], [3, 1, 1, 0, 1])
+
+    def test_no_open_tickets(self):
+        """ Test the statistics when all the tickets are closed. """
+        stats = self._compare([
+            ticket for ticket in TICKETS if ticket['status'] == 'Closed'])
+        self.assertEqual(stats['open'], 0)
+        self.assertEqual(stats['age_percentiles'], [None, None, None])
+        self.assertEqual(stats['age_histogram'], [0, 0, 0, 0, 0])
+
+    def test_no_tags(self):
+        """ Test the statistics when no ticket has tags. """
+        tickets = []
+        for ticket in TICKETS:
+            ticket = dict(ticket)
+            ticket['tags'] = []
+            tickets.append(ticket)
+        stats = self._compare(tickets)
+        self.assertEqual(stats['open_per_tag'], [])
+
+    def test_no_closed_at(self):
+        """ Test the statistics when no closed ticket has a closed_at. """
+        stats = self._compare([_ticket(1, DAY), _ticket(2, DAY, 'Closed')])
+        self.assertIsNone(stats['median_to_close'])
+
+    def test_bucket_edges(self):
+        """ Test the ages exactly on the edges of the buckets. """
+        stats = self._compare([
+            _ticket(idx, bound)
+            for idx, (_, bound) in enumerate(pag_off.stats.AGE_BUCKETS[:-1])
+        ])
+        self.assertEqual(stats['age_histogram'], [0, 1, 1, 1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)